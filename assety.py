@@ -0,0 +1,541 @@
+from __future__ import annotations
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+import functools
+import os
+import re
+
+from cachey import BlobCache, cache_from_args, sha256_file
+from downloady import cached_download
+from httpy import TransientError, get_transport
+from journaly import DOWNLOADED, REVERSIONED, UPLOADED, VALIDATED, Journal, JournalEntry
+from listy import BucketLister, shared_lister
+from pipeliney import Stage, run_pipeline
+from relayy import NotRelayable, relay as relay_wheel
+import tracey
+from wheely import Compression, ReversionCache, reversion
+
+def _get_json(url, *, missing_ok: bool = False, **kwargs):
+    def get():
+        response = get_transport().get(url, **kwargs)
+        if missing_ok and response.status_code == 404:
+            return {}
+        response.raise_for_status()
+        return response.json()
+    return get_transport().retrying(get, what=f"GET {url}")
+
+def get_pants_wheel_infos(tag_name, token, lister: BucketLister = shared_lister):
+    sha = _get_json(
+        f"https://api.github.com/repos/pantsbuild/pants/commits/{tag_name}",
+        headers={
+            "Authorization": f"Bearer {token}",
+        }
+    )["sha"]
+
+    for obj in lister.list(f"wheels/pantsbuild.pants/{sha}"):
+        if obj.key.endswith(".whl"):
+            yield obj.url, obj.basename, obj.etag, obj.size
+
+def get_pypi_whl_infos(version):
+    for package in ["pantsbuild.pants", "pantsbuild.pants.testutil"]:
+        # Versions that were never published to PyPI 404.
+        for info in _get_json(f"https://pypi.org/pypi/{package}/{version}/json", missing_ok=True).get("urls", []):
+            yield info["url"], info["filename"], info.get("digests", {}).get("sha256"), info.get("size")
+
+@dataclass(frozen=True)
+class WheelJob:
+    filename: str
+    url: str
+    pypi: bool
+    sha256: str | None = None
+    etag: str | None = None
+    # Bytes to transfer, from the listing or PyPI metadata (or a HEAD request); None if unknown.
+    size: int | None = None
+    reversion_cached: bool = False
+    upload_skipped: bool = False
+    # The journaled state a previous run left this job in, if its output is still intact.
+    resumed: str | None = None
+
+
+@dataclass(frozen=True)
+class ExistingAsset:
+    id: int
+    size: int
+    # GitHub reports digests as `sha256:<hex>`; assets uploaded before it started doing so have none.
+    digest: str | None
+
+    @property
+    def sha256(self) -> str | None:
+        algorithm, _, value = (self.digest or "").partition(":")
+        return value if algorithm == "sha256" and value else None
+
+    def matches(self, size: int, sha256: str) -> bool:
+        return self.size == size and self.sha256 == sha256
+
+
+def existing_assets(release) -> dict[str, ExistingAsset]:
+    return {
+        asset.name: ExistingAsset(asset.id, asset.size, getattr(asset, "digest", None))
+        for asset in release.assets
+    }
+
+
+def find_release_asset(release_id: int, name: str, token: str) -> dict | None:
+    url = f"https://api.github.com/repos/pantsbuild/pants/releases/{release_id}/assets"
+    page = 1
+    while True:
+        assets = _get_json(url, params={"per_page": 100, "page": page}, headers={"Authorization": f"Bearer {token}"})
+        for asset in assets:
+            if asset["name"] == name:
+                return asset
+        if len(assets) < 100:
+            return None
+        page += 1
+
+def delete_release_asset(asset_id: int, name: str, token: str) -> None:
+    def delete():
+        response = get_transport().delete(f"https://api.github.com/repos/pantsbuild/pants/releases/assets/{asset_id}",  headers={"Authorization": f"Bearer {token}"})
+        # Already gone, e.g. a retried delete that had actually gone through.
+        if response.status_code != 404:
+            response.raise_for_status()
+    get_transport().retrying(delete, what=f"delete of {name}")
+
+def plan_wheel_jobs(pants_map, pypi_map):
+    for filename, (url, etag, size) in pants_map.items():
+        reversioned_filename = re.sub(r"\+.*?-", "-", filename).replace('linux_', "manylinux2014_")
+        if reversioned_filename in pypi_map:
+            url, sha256, size = pypi_map[reversioned_filename]
+            yield WheelJob(reversioned_filename, url, pypi=True, sha256=sha256, size=size)
+        else:
+            yield WheelJob(filename, url, pypi=False, etag=etag, size=size)
+
+DEFAULT_HEAD_WORKERS = 8
+
+def _head_size(url: str) -> int | None:
+    def head():
+        response = get_transport().head(url, allow_redirects=True, headers={"Accept-Encoding": "identity"})
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        return int(size) if size is not None else None
+    return get_transport().retrying(head, what=f"HEAD {url}")
+
+def fill_sizes(jobs: list[WheelJob], *, workers: int = DEFAULT_HEAD_WORKERS) -> list[WheelJob]:
+    # The listings normally carry sizes already; HEAD whatever they didn't, concurrently.
+    unknown = [job for job in jobs if job.size is None]
+    if not unknown:
+        return jobs
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        sizes = dict(zip((job.url for job in unknown), pool.map(_head_size, (job.url for job in unknown))))
+    return [job if job.size is not None else replace(job, size=sizes[job.url]) for job in jobs]
+
+def _intact(entry: JournalEntry) -> bool:
+    return (
+        entry.filename is not None
+        and os.path.exists(entry.filename)
+        and os.path.getsize(entry.filename) == entry.size
+        and sha256_file(entry.filename) == entry.sha256
+    )
+
+def resume_jobs(
+    jobs, *, journal: Journal, tag_name: str, existing: dict[str, ExistingAsset], record: bool = True
+):
+    # Splits `jobs` into those still to run, fast-forwarded past whatever a previous run finished
+    # (and left intact on disk), and those the journal says are already uploaded. With
+    # `record=False` the journal is only read, for dry runs.
+    todo, done = [], []
+    for job in jobs:
+        digest = job.sha256 or job.etag
+        if record:
+            entry = journal.list(tag_name, job.url, digest)
+        else:
+            entry = journal.get(tag_name, job.url)
+            if entry is not None and entry.source_digest != digest:
+                entry = None
+        if entry is None:
+            todo.append(job)
+        elif entry.reached(UPLOADED):
+            asset = existing.get(entry.filename)
+            if asset is not None and asset.size == entry.size and asset.sha256 in (None, entry.sha256):
+                done.append(replace(job, filename=entry.filename, upload_skipped=True, resumed=entry.state))
+            else:
+                todo.append(job)
+        elif entry.reached(DOWNLOADED) and _intact(entry):
+            todo.append(replace(job, filename=entry.filename, resumed=entry.state))
+        else:
+            todo.append(job)
+    return todo, done
+
+def download_stage(
+    job: WheelJob,
+    *,
+    cache: BlobCache | None = None,
+    relay: bool = False,
+    journal: Journal | None = None,
+    tag_name: str = "",
+) -> WheelJob:
+    if relay and job.pypi:
+        # Streamed straight into the upload by `upload_stage`.
+        return job
+    if job.resumed:
+        print(f"Resuming {job.filename} from {job.resumed}")
+        return job
+    print(f"Downloading {job.url}")
+    result = cached_download(job.url, job.filename, cache=cache, sha256=job.sha256, etag=job.etag)
+    if result is None:
+        print(f"Using cached {job.filename} for {job.url}")
+    else:
+        print(f"Downloaded {job.filename} from {job.url}: {result.describe()}")
+    if journal is not None:
+        journal.record(
+            tag_name,
+            job.url,
+            DOWNLOADED,
+            filename=job.filename,
+            sha256=result.sha256 if result else sha256_file(job.filename),
+            size=os.path.getsize(job.filename),
+        )
+    return job
+
+def reversion_stage(
+    job: WheelJob,
+    *,
+    version: str,
+    cache: ReversionCache | None = None,
+    journal: Journal | None = None,
+    tag_name: str = "",
+    compression: Compression | None = None,
+) -> WheelJob:
+    if job.pypi:
+        print(f"PyPI release, skipping reversioning {job.filename}")
+        return job
+    if job.resumed in (REVERSIONED, VALIDATED):
+        return job
+
+    print(f"Reversioning {job.filename}")
+    hits = cache.hits if cache else 0
+    new_whl = reversion(
+        whl_file=job.filename,
+        dest_dir=".",
+        target_version=version,
+        extra_globs=["pants/_version/VERSION", "pants/VERSION"],
+        cache=cache,
+        compression=compression,
+    )
+    filename = new_whl.lstrip("./")
+    if journal is not None:
+        journal.record(
+            tag_name, job.url, REVERSIONED, filename=filename, sha256=sha256_file(filename), size=os.path.getsize(filename)
+        )
+    os.remove(job.filename)
+    return replace(job, filename=filename, reversion_cached=bool(cache and cache.hits > hits))
+
+def upload_stage(
+    job: WheelJob,
+    *,
+    release_id: int,
+    token: str,
+    existing: dict[str, ExistingAsset],
+    sync: bool = True,
+    relay: bool = False,
+    cache: BlobCache | None = None,
+    journal: Journal | None = None,
+    tag_name: str = "",
+) -> WheelJob:
+    filename = job.filename
+    relayed = relay and job.pypi
+    size = digest = None
+    if not relayed:
+        size, digest = os.path.getsize(filename), sha256_file(filename)
+        if journal is not None:
+            # What we upload must be exactly what an earlier stage produced and journaled.
+            entry = journal.get(tag_name, job.url)
+            if entry is None or entry.sha256 != digest:
+                raise Exception(f"{filename} no longer matches its journaled sha256")
+            journal.record(tag_name, job.url, VALIDATED, filename=filename, sha256=digest, size=size)
+    if filename in existing:
+        asset = existing[filename]
+        if relayed:
+            unchanged = bool(job.sha256) and asset.sha256 == job.sha256
+        else:
+            unchanged = asset.matches(size, digest)
+        if sync and unchanged:
+            print(f"Skipping unchanged {filename}")
+            if journal is not None:
+                journal.record(tag_name, job.url, UPLOADED, filename=filename, sha256=asset.sha256, size=asset.size)
+            if not relayed:
+                os.remove(filename)
+            return replace(job, upload_skipped=True)
+        delete_release_asset(asset.id, filename, token)
+
+    upload_url = f"https://uploads.github.com/repos/pantsbuild/pants/releases/{release_id}/assets"
+    upload_headers = {"Content-Type": "application/octet-stream", "Authorization": f"Bearer {token}"}
+    def put_asset(data, size, sha256):
+        response = get_transport().put(upload_url, params={"name": filename}, headers=upload_headers, data=data)
+        if response.status_code == 422:
+            # The name is taken. Either an earlier attempt landed but we never saw its response, or
+            # one failed partway and GitHub kept a "starter" asset; only the former is done.
+            asset = find_release_asset(release_id, filename, token)
+            if (
+                asset is not None
+                and asset.get("state") == "uploaded"
+                and asset.get("size") == size
+                and sha256
+                and asset.get("digest") == f"sha256:{sha256}"
+            ):
+                print(f"{filename} already exists intact, assuming an earlier attempt landed")
+                return
+            if asset is not None:
+                delete_release_asset(asset["id"], filename, token)
+            state = asset.get("state") if asset else "gone"
+            raise TransientError(f"{filename} already existed but didn't match ({state}); deleted it to upload again")
+        response.raise_for_status()
+
+    if relayed:
+        print(f"Relaying {job.url} to {filename}")
+        try:
+            result = get_transport().retrying(
+                lambda: relay_wheel(job.url, lambda body: put_asset(body, body.size, job.sha256), sha256=job.sha256),
+                what=f"relay of {filename}",
+                counter="retries.upload",
+            )
+            print(f"Uploaded {filename}: {result.describe()}")
+            if journal is not None:
+                journal.record(tag_name, job.url, UPLOADED, filename=filename, sha256=result.sha256, size=result.size)
+            return job
+        except NotRelayable:
+            print(f"Can't relay {job.url}, downloading it first")
+            download_stage(job, cache=cache)
+            size, digest = os.path.getsize(filename), sha256_file(filename)
+
+    print(f"Uploading {filename}")
+    def upload():
+        # Reopened on every attempt: a failed attempt leaves the previous handle part-read.
+        with open(filename, "rb") as f:
+            put_asset(f, size, digest)
+    get_transport().retrying(upload, what=f"upload of {filename}", counter="retries.upload")
+    tracey.count("bytes.uploaded", size)
+    if journal is not None:
+        journal.record(tag_name, job.url, UPLOADED, filename=filename, sha256=digest, size=size)
+
+    os.remove(filename)
+    return job
+
+
+def add_pipeline_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--reversion-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--upload-workers", type=int, default=4)
+    # N.B.: Explicit flag pairs rather than `argparse.BooleanOptionalAction`, which needs Python 3.9;
+    # the workflows run the system Python 3.8 on ubuntu-20.04.
+    parser.add_argument(
+        "--sync",
+        dest="sync",
+        action="store_true",
+        default=True,
+        help="Skip assets whose size and sha256 already match the release (the default).",
+    )
+    parser.add_argument("--no-sync", dest="sync", action="store_false")
+    parser.add_argument(
+        "--relay",
+        dest="relay",
+        action="store_true",
+        default=False,
+        help="Stream wheels already on PyPI straight into the release upload instead of via disk.",
+    )
+    parser.add_argument("--no-relay", dest="relay", action="store_false")
+
+@dataclass
+class ReleaseSummary:
+    version: str
+    uploaded: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    reversion_hits: int = 0
+    reversions: int = 0
+    error: str | None = None
+
+    def describe(self) -> str:
+        if self.error:
+            return f"{self.version}: FAILED\n  " + self.error.replace("\n", "\n  ")
+        return (
+            f"{self.version}: {len(self.uploaded)} uploaded, {len(self.skipped)} skipped, "
+            f"{self.reversion_hits}/{self.reversions} reversion(s) cached"
+        )
+
+
+def reversion_cache_from_args(args: argparse.Namespace) -> ReversionCache | None:
+    blobs = cache_from_args(args, "reversions")
+    if blobs is None:
+        return None
+    cache = ReversionCache(blobs)
+    if args.purge_reversion_cache:
+        cache.purge()
+    return None if args.no_reversion_cache else cache
+
+def _mb(size: int) -> str:
+    return f"{size / 1e6:.1f} MB"
+
+@dataclass(frozen=True)
+class ReleasePlan:
+    version: str
+    tag_name: str
+    # Still to run, largest first.
+    jobs: list[WheelJob]
+    # Already on the release, per PyPI digests or the journal.
+    unchanged: list[WheelJob]
+    relay: bool = False
+
+    def _bytes(self, jobs) -> int:
+        return sum(job.size or 0 for job in jobs)
+
+    @property
+    def downloads(self) -> list[WheelJob]:
+        return [job for job in self.jobs if not job.resumed and not (self.relay and job.pypi)]
+
+    @property
+    def reversions(self) -> list[WheelJob]:
+        return [job for job in self.jobs if not job.pypi and job.resumed in (None, DOWNLOADED)]
+
+    def headline(self) -> str:
+        unknown = sum(job.size is None for job in self.jobs)
+        return (
+            f"{self.version}: {len(self.jobs)} wheel(s) to upload ({_mb(self._bytes(self.jobs))}), "
+            f"{len(self.downloads)} download(s) ({_mb(self._bytes(self.downloads))}), "
+            f"{len(self.reversions)} reversion(s) ({_mb(self._bytes(self.reversions))}), "
+            f"{len(self.unchanged)} unchanged"
+            + (f", {unknown} of unknown size" if unknown else "")
+        )
+
+    def describe(self) -> str:
+        lines = [self.headline()]
+        for job in self.jobs:
+            size = "?" if job.size is None else _mb(job.size)
+            source = "pypi" if job.pypi else "s3"
+            resumed = f", resuming from {job.resumed}" if job.resumed else ""
+            lines.append(f"  {size:>10}  {job.filename} ({source}{resumed})")
+        return "\n".join(lines)
+
+
+def plan_release(
+    *,
+    version: str,
+    tag_name: str,
+    token: str,
+    existing: dict[str, ExistingAsset] | None = None,
+    sync: bool = True,
+    relay: bool = False,
+    journal: Journal | None = None,
+    dry_run: bool = False,
+    head_workers: int = DEFAULT_HEAD_WORKERS,
+) -> ReleasePlan:
+    # Works out everything a release upload will transfer before transferring any of it.
+    pypi_map = {filename: (url, sha256, size) for url, filename, sha256, size in get_pypi_whl_infos(version)}
+    pants_map = {filename: (url, etag, size) for url, filename, etag, size in get_pants_wheel_infos(tag_name, token)}
+
+    existing = existing or {}
+    jobs = list(plan_wheel_jobs(pants_map, pypi_map))
+    unchanged = []
+    if sync:
+        # PyPI gives us the digest up front, so identical PyPI wheels needn't even be downloaded.
+        unchanged = [
+            job
+            for job in jobs
+            if job.pypi
+            and job.sha256
+            and job.filename in existing
+            and existing[job.filename].sha256 == job.sha256
+        ]
+        jobs = [job for job in jobs if job not in unchanged]
+    if journal is not None:
+        jobs, uploaded = resume_jobs(
+            jobs, journal=journal, tag_name=tag_name, existing=existing, record=not dry_run
+        )
+        unchanged += uploaded
+    # Longest-processing-time first: starting the big native wheels first keeps them from being
+    # the tail of the run while the other workers sit idle.
+    jobs = sorted(fill_sizes(jobs, workers=head_workers), key=lambda job: job.size or 0, reverse=True)
+    return ReleasePlan(version, tag_name, jobs, unchanged, relay=relay)
+
+def upload_release_wheels(
+    *,
+    release,
+    version: str,
+    tag_name: str,
+    token: str,
+    existing: dict[str, ExistingAsset] | None = None,
+    sync: bool = True,
+    download_workers: int = 4,
+    reversion_workers: int = 1,
+    upload_workers: int = 4,
+    cache: BlobCache | None = None,
+    reversion_cache: ReversionCache | None = None,
+    relay: bool = False,
+    journal: Journal | None = None,
+    compression: Compression | None = None,
+) -> ReleaseSummary:
+    existing = existing or {}
+    plan = plan_release(
+        version=version, tag_name=tag_name, token=token, existing=existing, sync=sync, relay=relay, journal=journal
+    )
+    jobs, unchanged = plan.jobs, plan.unchanged
+    uploaded = sum(job.resumed is not None for job in unchanged)
+    resumed = sum(job.resumed is not None for job in jobs)
+    if uploaded or resumed:
+        print(f"Journal: {uploaded} already uploaded, resuming {resumed} part-done wheel(s)")
+    print(plan.headline())
+    print(f"Uploading wheels for {version}")
+    jobs = run_pipeline(
+        jobs,
+        [
+            Stage(
+                "download",
+                functools.partial(download_stage, cache=cache, relay=relay, journal=journal, tag_name=tag_name),
+                workers=download_workers,
+            ),
+            Stage(
+                "reversion",
+                functools.partial(
+                    reversion_stage,
+                    version=version,
+                    cache=reversion_cache,
+                    journal=journal,
+                    tag_name=tag_name,
+                    compression=compression,
+                ),
+                workers=reversion_workers,
+                processes=True,
+            ),
+            Stage(
+                "upload",
+                functools.partial(
+                    upload_stage,
+                    release_id=release.id,
+                    token=token,
+                    existing=existing,
+                    sync=sync,
+                    relay=relay,
+                    cache=cache,
+                    journal=journal,
+                    tag_name=tag_name,
+                ),
+                workers=upload_workers,
+            ),
+        ],
+        label=lambda job: job.filename,
+        priority=lambda job: job.size or 0,
+    )
+    # Reversions run in worker processes, so tally the cache counters from the results.
+    summary = ReleaseSummary(
+        version=version,
+        uploaded=sorted(job.filename for job in jobs if not job.upload_skipped),
+        skipped=sorted([job.filename for job in unchanged] + [job.filename for job in jobs if job.upload_skipped]),
+        reversion_hits=sum(job.reversion_cached for job in jobs if not job.pypi),
+        reversions=sum(not job.pypi for job in jobs),
+    )
+    if reversion_cache is not None:
+        print(f"Reversion cache: {summary.reversion_hits} hit(s), {summary.reversions - summary.reversion_hits} miss(es)")
+    if summary.skipped:
+        print(f"Skipped {len(summary.skipped)} unchanged asset(s):")
+        for filename in summary.skipped:
+            print(f"  {filename}")
+    return summary
@@ -0,0 +1,237 @@
+from __future__ import annotations
+import argparse
+import base64
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+import wheely
+
+INPUT_VERSION = "2.18.0.dev5+gitabc123"
+TARGET_VERSION = "2.18.0.dev5"
+EXTRA_GLOBS = ["pants/_version/VERSION", "pants/VERSION"]
+
+
+@dataclass(frozen=True)
+class WheelShape:
+    name: str
+    small_files: int
+    small_size: int
+    huge_files: int
+    huge_size: int
+
+
+SHAPES = [
+    WheelShape("many-small", small_files=3000, small_size=4 * 1024, huge_files=0, huge_size=0),
+    WheelShape("huge-native", small_files=50, small_size=4 * 1024, huge_files=2, huge_size=48 * 1024 * 1024),
+    WheelShape("big-record", small_files=30000, small_size=128, huge_files=0, huge_size=0),
+]
+
+
+def _payload(rng: random.Random, size: int, compressible: bool) -> bytes:
+    if compressible:
+        line = b"def f(x):\n    return x  # " + INPUT_VERSION.encode() + b"\n"
+        return (line * (size // len(line) + 1))[:size]
+    # Native code compresses roughly 3:1; mix random and repeated blocks to approximate that.
+    # N.B.: What `Random.randbytes` (Python 3.9+) does, byte for byte.
+    def random_block():
+        return rng.getrandbits(4096 * 8).to_bytes(4096, "little")
+
+    block = random_block()
+    return b"".join(random_block() if i % 3 == 0 else block for i in range(size // 4096 + 1))[:size]
+
+def make_wheel(
+    directory: str,
+    shape: WheelShape,
+    scale: float = 1.0,
+    seed: int = 0,
+    *,
+    version: str = INPUT_VERSION,
+    platform_tag: str = "linux_x86_64",
+) -> str:
+    rng = random.Random(seed)
+    dist_info = f"pantsbuild.pants-{version}.dist-info"
+    files: dict[str, bytes] = {}
+    for i in range(max(1, int(shape.small_files * scale))):
+        files[f"pants/pkg{i % 50}/mod{i}.py"] = _payload(rng, shape.small_size, compressible=True)
+    for i in range(shape.huge_files):
+        files[f"pants/engine/internals/native_engine{i}.so"] = _payload(
+            rng, int(shape.huge_size * scale), compressible=False
+        )
+    files["pants/VERSION"] = f"{version}\n".encode()
+    files[f"{dist_info}/METADATA"] = (
+        f"Metadata-Version: 2.1\nName: pantsbuild.pants\nVersion: {version}\n".encode()
+    )
+    files[f"{dist_info}/WHEEL"] = (
+        f"Wheel-Version: 1.0\nRoot-Is-Purelib: false\nTag: cp39-cp39-{platform_tag}\n".encode()
+    )
+    files[f"{dist_info}/entry_points.txt"] = b"[console_scripts]\npants = pants.bin.pants_loader:main\n"
+    records = []
+    for name, data in files.items():
+        digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=").decode()
+        records.append(f"{name},sha256={digest},{len(data)}")
+    records.append(f"{dist_info}/RECORD,,")
+    files[f"{dist_info}/RECORD"] = ("\n".join(records) + "\n").encode()
+
+    path = os.path.join(directory, f"pantsbuild.pants-{version}-cp39-cp39-{platform_tag}.whl")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as whl:
+        for name, data in files.items():
+            whl.writestr(name, data)
+    return path
+
+
+@dataclass(frozen=True)
+class Measurement:
+    shape: str
+    stage: str
+    seconds: float
+    peak_bytes: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.shape}/{self.stage}"
+
+
+def measure(shape: str, stage: str, fn, *, repeat: int, setup=None) -> Measurement:
+    # Time without tracemalloc (it slows allocation-heavy code a lot), then take one traced run
+    # for the peak Python heap.
+    timings = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Measurement(shape, stage, min(timings), peak)
+
+
+def run_shape(shape: WheelShape, *, scale: float, repeat: int) -> list[Measurement]:
+    with tempfile.TemporaryDirectory() as tmp:
+        whl_file = make_wheel(tmp, shape, scale=scale)
+        out_dir = os.path.join(tmp, "out")
+        os.mkdir(out_dir)
+        workspace = os.path.join(tmp, "workspace")
+        with zipfile.ZipFile(whl_file) as whl:
+            whl.extractall(workspace)
+            names = whl.namelist()
+        dist_info_dir = wheely.locate_dist_info_dir(workspace)
+        record_file = os.path.join(dist_info_dir, "RECORD")
+        largest = max(names, key=lambda name: os.path.getsize(os.path.join(workspace, name)))
+
+        def reversion(stream):
+            def run():
+                dst = wheely.reversion(
+                    whl_file=whl_file,
+                    dest_dir=out_dir,
+                    target_version=TARGET_VERSION,
+                    extra_globs=EXTRA_GLOBS,
+                    stream=stream,
+                )
+                os.remove(dst)
+            return run
+
+        def fresh_record():
+            # `rewrite_record_file` rewrites RECORD in place, so restore it before every run.
+            with zipfile.ZipFile(whl_file) as whl:
+                with open(os.path.join(workspace, record_file), "wb") as f:
+                    f.write(whl.read(record_file))
+            mutated = [(record_file, record_file)] + [
+                (name, name) for name in names if wheely.any_match(["*.dist-info/*"], name)
+            ]
+            return (workspace, record_file, mutated)
+
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                return [
+                    measure(shape.name, "reversion-stream", reversion(True), repeat=repeat),
+                    measure(shape.name, "reversion-extract", reversion(False), repeat=repeat),
+                    measure(
+                        shape.name,
+                        "replace_in_file",
+                        # Same from/to, so the workspace is left as it was.
+                        lambda: wheely.replace_in_file(workspace, largest, INPUT_VERSION, INPUT_VERSION),
+                        repeat=repeat,
+                    ),
+                    measure(
+                        shape.name,
+                        "fingerprint_file",
+                        lambda: wheely.fingerprint_file(workspace, largest),
+                        repeat=repeat,
+                    ),
+                    measure(
+                        shape.name,
+                        "rewrite_record_file",
+                        wheely.rewrite_record_file,
+                        repeat=repeat,
+                        setup=fresh_record,
+                    ),
+                    measure(
+                        shape.name, "validate_wheel", lambda: wheely.validate_wheel(whl_file), repeat=repeat
+                    ),
+                ]
+            finally:
+                sys.stdout = stdout
+
+
+def compare(measurements: list[Measurement], baseline: dict[str, dict], threshold: float) -> list[str]:
+    regressions = []
+    for m in measurements:
+        base = baseline.get(m.key)
+        if not base:
+            continue
+        for field_name, value in (("seconds", m.seconds), ("peak_bytes", m.peak_bytes)):
+            previous = base[field_name]
+            if field_name == "seconds" and previous < 0.001:
+                # Sub-millisecond timings are mostly noise.
+                continue
+            if previous and value > previous * (1 + threshold):
+                regressions.append(
+                    f"{m.key} {field_name}: {previous:.4g} -> {value:.4g} (+{(value / previous - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for wheel reversioning.")
+    parser.add_argument("--shape", action="append", choices=[s.name for s in SHAPES])
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplies file counts and sizes.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", help="JSON file of a previous --save-baseline run to compare against.")
+    parser.add_argument("--save-baseline", help="Write this run's results as a baseline JSON file.")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="Fractional slowdown or growth that counts as a regression."
+    )
+    args = parser.parse_args()
+
+    measurements = []
+    for shape in SHAPES:
+        if args.shape and shape.name not in args.shape:
+            continue
+        for m in run_shape(shape, scale=args.scale, repeat=args.repeat):
+            print(f"{m.key:40} {m.seconds * 1000:10.1f} ms {m.peak_bytes / 1e6:10.1f} MB peak")
+            measurements.append(m)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({m.key: asdict(m) for m in measurements}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(measurements, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,177 @@
+from __future__ import annotations
+import argparse
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "GHATEST_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ghatest")
+)
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+
+def cache_key(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+def sha256_file(path: str | Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _link_or_copy(src: str | Path, dst: str | Path) -> None:
+    dst = Path(dst)
+    tmp = dst.parent / f".tmp-{dst.name}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class BlobCache:
+    # Blobs live under `blobs/` named by the sha256 of their content, and `keys/` maps a caller's
+    # key (see `cache_key`) to a blob. Every write lands in a temp file and is renamed into place,
+    # so concurrent writers (threads or separate runs) can only ever race to write the same bytes.
+    # A blob's mtime is bumped on every hit and eviction drops the least recently used blobs.
+
+    def __init__(self, root: str | Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._blobs = self.root / "blobs"
+        self._keys = self.root / "keys"
+        self._blobs.mkdir(parents=True, exist_ok=True)
+        self._keys.mkdir(parents=True, exist_ok=True)
+
+    def _blob_path(self, digest: str) -> Path:
+        return self._blobs / digest[:2] / digest
+
+    def _key_path(self, key: str) -> Path:
+        return self._keys / key[:2] / key
+
+    def _write_atomic(self, path: Path, payload: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+    def lookup(self, key: str) -> Path | None:
+        try:
+            digest = self._key_path(key).read_text().strip()
+        except FileNotFoundError:
+            return None
+        blob = self._blob_path(digest)
+        try:
+            os.utime(blob)
+        except FileNotFoundError:
+            return None
+        return blob
+
+    def get(self, key: str, dest: str | Path) -> bool:
+        blob = self.lookup(key)
+        if blob is None:
+            return False
+        try:
+            _link_or_copy(blob, dest)
+        except FileNotFoundError:
+            # Evicted between the lookup and the link.
+            return False
+        return True
+
+    def get_bytes(self, key: str) -> bytes | None:
+        blob = self.lookup(key)
+        if blob is None:
+            return None
+        try:
+            return blob.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put_bytes(self, key: str, payload: bytes) -> Path:
+        digest = hashlib.sha256(payload).hexdigest()
+        blob = self._blob_path(digest)
+        if not blob.exists():
+            self._write_atomic(blob, payload)
+        os.utime(blob)
+        self._write_atomic(self._key_path(key), digest.encode("ascii"))
+        self.evict()
+        return blob
+
+    def put(self, key: str, src: str | Path, digest: str | None = None) -> Path:
+        digest = digest or sha256_file(src)
+        blob = self._blob_path(digest)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            _link_or_copy(src, blob)
+        os.utime(blob)
+        self._write_atomic(self._key_path(key), digest.encode("ascii"))
+        self.evict()
+        return blob
+
+    @contextmanager
+    def _lock(self):
+        with open(self.root / ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _entries(self, directory: Path):
+        for path in directory.glob("*/*"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            yield path, st
+
+    def size(self) -> int:
+        return sum(st.st_size for _, st in self._entries(self._blobs))
+
+    def evict(self, max_bytes: int | None = None) -> int:
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        evicted = 0
+        with self._lock():
+            blobs = sorted(self._entries(self._blobs), key=lambda entry: entry[1].st_mtime)
+            total = sum(st.st_size for _, st in blobs)
+            for path, st in blobs:
+                if total <= max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= st.st_size
+                evicted += 1
+        # Keys pointing at evicted blobs are treated as misses by `lookup` and overwritten by the
+        # next `put`, so there's no need to sweep them here.
+        return evicted
+
+    def purge(self) -> None:
+        with self._lock():
+            shutil.rmtree(self._blobs, ignore_errors=True)
+            shutil.rmtree(self._keys, ignore_errors=True)
+            self._blobs.mkdir(parents=True, exist_ok=True)
+            self._keys.mkdir(parents=True, exist_ok=True)
+
+
+def add_cache_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--cache-max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--no-reversion-cache", action="store_true")
+    parser.add_argument("--purge-reversion-cache", action="store_true")
+
+def cache_from_args(args: argparse.Namespace, name: str = "wheels") -> BlobCache | None:
+    if args.no_cache:
+        return None
+    return BlobCache(os.path.join(args.cache_dir, name), max_bytes=args.cache_max_bytes)
@@ -0,0 +1,160 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import hashlib
+import os
+import time
+
+from cachey import cache_key
+from httpy import get_transport, is_retryable
+import tracey
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ChecksumMismatch(DownloadError):
+    pass
+
+
+@dataclass(frozen=True)
+class DownloadResult:
+    url: str
+    path: str
+    size: int
+    sha256: str
+    elapsed: float
+    attempts: int
+    resumed_bytes: int
+
+    @property
+    def throughput(self) -> float:
+        return self.size / self.elapsed if self.elapsed else float("inf")
+
+    def describe(self) -> str:
+        resumed = f", resumed {self.resumed_bytes} bytes" if self.resumed_bytes else ""
+        return (
+            f"{self.size / 1e6:.1f} MB in {self.elapsed:.2f}s "
+            f"({self.throughput / 1e6:.1f} MB/s, {self.attempts} attempt(s){resumed})"
+        )
+
+
+def _hash_existing(path: str, chunk_size: int):
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher, size
+
+def download(
+    url: str,
+    path: str,
+    *,
+    sha256: str | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    retries: int | None = None,
+    session=None,
+    headers: dict[str, str] | None = None,
+) -> DownloadResult:
+    # Streams `url` into `path`, hashing as it goes. A failed attempt keeps what it wrote and the
+    # next one asks for the rest with a `Range` header; servers that ignore the range get a
+    # clean restart.
+    session = session or get_transport()
+    policy = get_transport().retry_policy
+    retries = retries or policy.attempts
+    hasher = hashlib.sha256()
+    offset = 0
+    resumed_bytes = 0
+    last_error: BaseException | None = None
+    start = time.perf_counter()
+    if os.path.exists(path):
+        os.unlink(path)
+
+    for attempt in range(1, retries + 1):
+        if attempt > 1:
+            tracey.count("retries.download")
+            time.sleep(policy.delay_after(attempt - 1, last_error))
+        request_headers = dict(headers or {})
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+        received = 0
+        try:
+            with session.get(url, stream=True, headers=request_headers) as response:
+                if offset and response.status_code == 206:
+                    content_range = response.headers.get("Content-Range", "")
+                    if not content_range.startswith(f"bytes {offset}-"):
+                        raise DownloadError(f"Unexpected Content-Range {content_range!r} for {url}")
+                    # What the finished file owes to earlier attempts, not a running total: a
+                    # second resume re-covers the first one's prefix.
+                    resumed_bytes = offset
+                    mode = "ab"
+                else:
+                    response.raise_for_status()
+                    hasher = hashlib.sha256()
+                    offset = 0
+                    resumed_bytes = 0
+                    mode = "wb"
+                with open(path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        offset += len(chunk)
+                        received += len(chunk)
+        except Exception as e:
+            if not (isinstance(e, DownloadError) or is_retryable(e)):
+                raise DownloadError(f"Failed to download {url}: {e!r}") from e
+            last_error = e
+            # Whatever made it to disk is still good for a ranged retry, but the in-memory hash
+            # may be ahead of or behind the file, so re-derive both from the file itself.
+            if os.path.exists(path):
+                hasher, offset = _hash_existing(path, chunk_size)
+            continue
+        finally:
+            tracey.count("bytes.downloaded", received)
+
+        digest = hasher.hexdigest()
+        if sha256 and digest != sha256.lower():
+            last_error = ChecksumMismatch(f"sha256 of {url} was {digest}, expected {sha256}")
+            os.unlink(path)
+            hasher = hashlib.sha256()
+            offset = 0
+            continue
+
+        return DownloadResult(
+            url=url,
+            path=path,
+            size=offset,
+            sha256=digest,
+            elapsed=time.perf_counter() - start,
+            attempts=attempt,
+            resumed_bytes=resumed_bytes,
+        )
+
+    if isinstance(last_error, DownloadError):
+        raise last_error
+    raise DownloadError(f"Failed to download {url} after {retries} attempt(s): {last_error!r}") from last_error
+
+def cached_download(
+    url: str,
+    path: str,
+    *,
+    cache=None,
+    sha256: str | None = None,
+    etag: str | None = None,
+    **kwargs,
+) -> DownloadResult | None:
+    # Reads through `cache` (a `cachey.BlobCache`) when the remote content can be pinned by a
+    # digest or ETag; returns None on a cache hit.
+    key = None
+    if cache is not None and (sha256 or etag):
+        key = cache_key(url, sha256 or etag)
+        if cache.get(key, path):
+            return None
+    result = download(url, path, sha256=sha256, **kwargs)
+    if key is not None:
+        cache.put(key, path, digest=result.sha256)
+    return result
@@ -0,0 +1,48 @@
+from __future__ import annotations
+import os
+import subprocess
+import threading
+
+import startupy
+
+# The GitHub token and PyGithub client, built on first use and shared by the whole process.
+# Importing PyGithub alone costs a few hundred milliseconds, so nothing here touches it until a
+# caller actually needs the API.
+
+REPO_NAME = "pantsbuild/pants"
+
+_lock = threading.Lock()
+_token: str | None = None
+_client = None
+_repos: dict = {}
+
+
+def get_token() -> str:
+    global _token
+    with _lock:
+        if _token is None:
+            # `gh auth token` just echoes these when they're set, so skip the subprocess.
+            _token = os.environ.get("GH_TOKEN") or os.environ.get("GITHUB_TOKEN")
+            if not _token:
+                with startupy.phase("gh auth token"):
+                    _token = subprocess.run(
+                        ["gh", "auth", "token"], check=True, text=True, capture_output=True
+                    ).stdout.strip()
+        return _token
+
+def get_github():
+    global _client
+    token = get_token()
+    with _lock:
+        if _client is None:
+            with startupy.phase("import github"):
+                import github
+            _client = github.Github(auth=github.Auth.Token(token))
+        return _client
+
+def get_repo(name: str = REPO_NAME):
+    client = get_github()
+    with _lock:
+        if name not in _repos:
+            _repos[name] = client.get_repo(name)
+        return _repos[name]
@@ -0,0 +1,336 @@
+from __future__ import annotations
+import argparse
+from dataclasses import dataclass
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, TypeVar
+import urllib.parse
+
+import tracey
+
+# `requests` (and urllib3 under it) is imported on first use rather than here, so the scripts
+# that import this module don't pay for it until they actually talk to something.
+if TYPE_CHECKING:
+    import requests
+
+DEFAULT_POOL_CONNECTIONS = 8
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 300.0
+DEFAULT_RETRIES = 5
+DEFAULT_RETRY_BASE_DELAY = 1.0
+DEFAULT_RETRY_MAX_DELAY = 60.0
+# Never trust a rate-limit reset further out than this.
+MAX_RATE_LIMIT_WAIT = 3600.0
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = DEFAULT_RETRIES
+    base_delay: float = DEFAULT_RETRY_BASE_DELAY
+    max_delay: float = DEFAULT_RETRY_MAX_DELAY
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        # "Full jitter" exponential backoff, unless the server told us how long to wait.
+        if retry_after is not None:
+            return min(retry_after, MAX_RATE_LIMIT_WAIT)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def delay_after(self, attempt: int, error: BaseException | None) -> float:
+        response = getattr(error, "response", None)
+        return self.delay(attempt, _retry_after(response) if response is not None else None)
+
+
+def _retry_after(response: requests.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+def _is_rate_limited(response: requests.Response) -> bool:
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    # GitHub reports both primary and secondary rate limits as 403s; plain permission errors
+    # have neither of these.
+    return (
+        response.headers.get("X-RateLimit-Remaining") == "0"
+        or "Retry-After" in response.headers
+        or "rate limit" in response.text.lower()
+    )
+
+class TransientError(Exception):
+    # Raised from inside `retrying` for a failure the caller has already cleaned up after, so
+    # another attempt can succeed.
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    # Anything not listed here (a 404, a 422 from GitHub, a missing local file) won't be fixed by
+    # trying again.
+    if isinstance(error, TransientError):
+        return True
+    from xml.etree import ElementTree
+
+    import requests
+    import urllib3
+
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        response = error.response
+        return response.status_code >= 500 or response.status_code == 408 or _is_rate_limited(response)
+    # PyGithub raises its own exceptions for error responses, carrying just the status.
+    status = getattr(error, "status", None)
+    if type(error).__module__.startswith("github.") and isinstance(status, int):
+        return status >= 500 or status in (408, 429) or type(error).__name__ == "RateLimitExceededException"
+    # Reading `response.raw` directly (e.g. streaming a listing into `iterparse`) skips requests'
+    # wrapping, so a body cut short surfaces as urllib3's own errors, or as a parse error when
+    # nothing said how long it should have been.
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            urllib3.exceptions.ProtocolError,
+            urllib3.exceptions.ReadTimeoutError,
+            ElementTree.ParseError,
+        ),
+    )
+
+
+class HostLimiter:
+    # Per-host admission control. The token budget comes from GitHub's `X-RateLimit-*` headers:
+    # once `remaining` hits zero, callers wait for the advertised reset. Concurrency is capped
+    # AIMD-style: a secondary rate limit halves the cap and every `cap` successes raise it by one.
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = self.max_concurrency
+        self.in_flight = 0
+        self.remaining: int | None = None
+        self.reset_at = 0.0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while True:
+                now = time.time()
+                if self.remaining is not None and self.remaining <= 0 and now < self.reset_at:
+                    wait = min(self.reset_at - now, MAX_RATE_LIMIT_WAIT)
+                    tracey.count("ratelimit.waits")
+                    self._cond.wait(wait)
+                    continue
+                if self.in_flight >= self.concurrency:
+                    self._cond.wait()
+                    continue
+                break
+            self.in_flight += 1
+            if self.remaining is not None:
+                self.remaining -= 1
+
+    def release(self, response: requests.Response | None) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if response is not None:
+                self._observe(response)
+            self._cond.notify_all()
+
+    def _observe(self, response: requests.Response) -> None:
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is not None and reset is not None:
+            try:
+                self.remaining, self.reset_at = int(remaining), float(reset)
+            except ValueError:
+                pass
+        if _is_rate_limited(response):
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+            tracey.gauge("ratelimit.concurrency", self.concurrency)
+        elif response.status_code < 400:
+            self._successes += 1
+            if self._successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._successes = 0
+
+
+@dataclass(frozen=True)
+class HostStats:
+    host: str
+    requests: int
+    connections: int
+
+    @property
+    def reused(self) -> int:
+        return max(0, self.requests - self.connections)
+
+
+class Transport:
+    # One `requests.Session` for all GitHub, PyPI and S3 traffic. urllib3 keeps a keep-alive
+    # connection pool per host under it: `pool_connections` is how many hosts' pools are kept
+    # around and `pool_maxsize` is how many connections each host may hold.
+
+    def __init__(
+        self,
+        *,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        url_map: dict[str, str] | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._max_concurrency = pool_maxsize
+        self._limiters: dict[str, HostLimiter] = {}
+        self._limiters_lock = threading.Lock()
+        # Rewrites URL prefixes before sending, e.g. to point the scripts at local stand-ins.
+        self.url_map = dict(url_map or {})
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    def rewrite_url(self, url: str) -> str:
+        for prefix, replacement in self.url_map.items():
+            if url.startswith(prefix):
+                return replacement + url[len(prefix):]
+        return url
+
+    def limiter(self, url: str) -> HostLimiter:
+        host = urllib.parse.urlsplit(url).netloc
+        with self._limiters_lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = HostLimiter(self._max_concurrency)
+            return limiter
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        # Every request goes through its host's limiter, but only `retrying` retries: a request
+        # body may be a half-consumed file, so the caller has to rebuild it.
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.rewrite_url(url)
+        limiter = self.limiter(url)
+        limiter.acquire()
+        response = None
+        try:
+            response = self.session.request(method, url, **kwargs)
+            return response
+        finally:
+            limiter.release(response)
+
+    def retrying(self, fn: Callable[[], T], *, what: str, counter: str = "retries.http") -> T:
+        # Calls `fn` until it succeeds, sleeping with backoff between transient failures (5xx,
+        # rate limits, dropped connections). `fn` should `raise_for_status()`. Anything else, or
+        # running out of attempts, is raised to the caller.
+        policy = self.retry_policy
+        for attempt in range(1, policy.attempts + 1):
+            try:
+                return fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt == policy.attempts:
+                    raise
+                delay = policy.delay_after(attempt, e)
+                print(f"Retrying {what} in {delay:.1f}s after attempt {attempt} failed: {e!r}")
+                tracey.count(counter)
+                time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def stats(self) -> list[HostStats]:
+        pools = self._adapter.poolmanager.pools
+        stats = []
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats.append(
+                HostStats(
+                    host=f"{pool.scheme}://{pool.host}:{pool.port}",
+                    requests=pool.num_requests,
+                    connections=pool.num_connections,
+                )
+            )
+        return stats
+
+    def describe_stats(self) -> str:
+        return "\n".join(
+            f"{s.host}: {s.requests} request(s) over {s.connections} connection(s), {s.reused} reused"
+            for s in self.stats()
+        )
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_transport: Transport | None = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> Transport:
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
+
+def configure_transport(**kwargs) -> Transport:
+    global _transport
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = Transport(**kwargs)
+        return _transport
+
+
+def add_http_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--pool-connections", type=int, default=DEFAULT_POOL_CONNECTIONS)
+    parser.add_argument("--pool-maxsize", type=int, default=DEFAULT_POOL_MAXSIZE)
+    parser.add_argument("--connect-timeout", type=float, default=DEFAULT_CONNECT_TIMEOUT)
+    parser.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT)
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Attempts per request.")
+    parser.add_argument(
+        "--retry-base-delay",
+        type=float,
+        default=DEFAULT_RETRY_BASE_DELAY,
+        help="Backoff before the first retry; doubles (with jitter) every attempt.",
+    )
+    parser.add_argument("--retry-max-delay", type=float, default=DEFAULT_RETRY_MAX_DELAY)
+
+def configure_transport_from_args(args: argparse.Namespace) -> Transport:
+    return configure_transport(
+        pool_connections=args.pool_connections,
+        pool_maxsize=args.pool_maxsize,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        retry_policy=RetryPolicy(
+            attempts=max(1, args.retries), base_delay=args.retry_base_delay, max_delay=args.retry_max_delay
+        ),
+    )
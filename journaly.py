@@ -0,0 +1,132 @@
+from __future__ import annotations
+import argparse
+from dataclasses import dataclass
+import os
+import sqlite3
+import threading
+import time
+
+# A per-asset record of how far each release upload got, so a rerun can pick up where a killed
+# one stopped instead of deleting and re-uploading everything. Every transition is committed
+# only after the work it describes is complete (the file is on disk or the upload was accepted),
+# so whatever the journal says has happened, has.
+
+DEFAULT_JOURNAL = ".uploady-journal.sqlite"
+
+LISTED = "listed"
+DOWNLOADED = "downloaded"
+REVERSIONED = "reversioned"
+VALIDATED = "validated"
+UPLOADED = "uploaded"
+STATES = (LISTED, DOWNLOADED, REVERSIONED, VALIDATED, UPLOADED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    release TEXT NOT NULL,
+    url TEXT NOT NULL,
+    source_digest TEXT,
+    state TEXT NOT NULL,
+    filename TEXT,
+    sha256 TEXT,
+    size INTEGER,
+    updated REAL NOT NULL,
+    PRIMARY KEY (release, url)
+)
+"""
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    url: str
+    source_digest: str | None
+    state: str
+    filename: str | None
+    sha256: str | None
+    size: int | None
+
+    def reached(self, state: str) -> bool:
+        return STATES.index(self.state) >= STATES.index(state)
+
+
+class Journal:
+    # Safe to share between threads and to pickle into worker processes: each thread opens its
+    # own connection, and WAL mode lets them write without blocking readers.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(_SCHEMA)
+            db.commit()
+            self._local.db = db
+        return db
+
+    def get(self, release: str, url: str) -> JournalEntry | None:
+        row = self._db().execute(
+            "SELECT url, source_digest, state, filename, sha256, size FROM assets WHERE release = ? AND url = ?",
+            (release, url),
+        ).fetchone()
+        return None if row is None else JournalEntry(*row)
+
+    def list(self, release: str, url: str, source_digest: str | None) -> JournalEntry | None:
+        # Starts tracking an asset. Returns the entry a previous run left, unless the source has
+        # changed since, in which case that progress is thrown away.
+        entry = self.get(release, url)
+        if entry is not None and entry.source_digest == source_digest:
+            return entry
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, NULL, NULL, NULL, ?)",
+                (release, url, source_digest, LISTED, time.time()),
+            )
+        return None
+
+    def record(
+        self, release: str, url: str, state: str, *, filename: str, sha256: str | None = None, size: int | None = None
+    ) -> None:
+        with self._db() as db:
+            db.execute(
+                "UPDATE assets SET state = ?, filename = ?, sha256 = ?, size = ?, updated = ? WHERE release = ? AND url = ?",
+                (state, filename, sha256, size, time.time(), release, url),
+            )
+
+    def forget(self, release: str | None = None) -> None:
+        with self._db() as db:
+            if release is None:
+                db.execute("DELETE FROM assets")
+            else:
+                db.execute("DELETE FROM assets WHERE release = ?", (release,))
+
+    def summary(self, release: str) -> dict[str, int]:
+        return dict(
+            self._db().execute("SELECT state, COUNT(*) FROM assets WHERE release = ? GROUP BY state", (release,))
+        )
+
+
+def add_journal_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--journal",
+        default=DEFAULT_JOURNAL,
+        help="SQLite file recording per-asset progress, so a rerun resumes where the last run stopped.",
+    )
+    parser.add_argument("--no-journal", dest="journal", action="store_const", const=None)
+    parser.add_argument("--reset-journal", action="store_true", help="Forget all recorded progress first.")
+
+def journal_from_args(args: argparse.Namespace) -> Journal | None:
+    if not args.journal:
+        return None
+    journal = Journal(os.path.abspath(args.journal))
+    if args.reset_journal:
+        journal.forget()
+    return journal
@@ -0,0 +1,132 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import functools
+import threading
+import time
+import urllib.parse
+from xml.etree import ElementTree
+
+from httpy import get_transport
+import tracey
+
+BUCKET_URL = "https://binaries.pantsbuild.org"
+
+
+@dataclass(frozen=True)
+class BucketObject:
+    key: str
+    etag: str | None
+    size: int | None
+
+    @property
+    def url(self) -> str:
+        return f"{BUCKET_URL}/{urllib.parse.quote(self.key)}"
+
+    @property
+    def basename(self) -> str:
+        return self.key.rsplit("/", 1)[-1]
+
+
+def _local_name(tag: str) -> str:
+    # N.B.: S3 bucket listings use a default namespace. Although the URI is apparently stable,
+    # we decouple from it by ignoring it.
+    return tag.rsplit("}", 1)[-1]
+
+def parse_listing_page(stream) -> tuple[list[BucketObject], bool, str | None]:
+    objects = []
+    truncated = False
+    next_marker = None
+    fields: dict[str, str] = {}
+    for _, element in ElementTree.iterparse(stream, events=("end",)):
+        name = _local_name(element.tag)
+        if name in ("Key", "ETag", "Size"):
+            fields[name] = element.text or ""
+        elif name == "Contents":
+            size = fields.get("Size")
+            objects.append(
+                BucketObject(
+                    key=fields["Key"],
+                    etag=fields.get("ETag"),
+                    size=int(size) if size else None,
+                )
+            )
+            fields = {}
+            element.clear()
+        elif name == "IsTruncated":
+            truncated = (element.text or "").strip().lower() == "true"
+        elif name == "NextMarker":
+            # N.B.: Not `NextContinuationToken`, which is only meaningful to a list-type=2
+            # `continuation-token` and would restart or skip pages if passed as a V1 `marker`.
+            next_marker = element.text
+    return objects, truncated, next_marker
+
+
+class BucketLister:
+    # Lists S3 prefixes, following `IsTruncated` pages, and remembers each prefix's listing for
+    # `ttl` seconds so repeated lookups within a run (e.g. the shared 3rdparty prefixes across
+    # releases) don't go back to the bucket.
+
+    def __init__(
+        self,
+        base_url: str = BUCKET_URL,
+        *,
+        ttl: float = 300.0,
+        max_workers: int = 8,
+        session=None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.session = session
+        self._cache: dict[str, tuple[float, list[BucketObject]]] = {}
+        self._lock = threading.Lock()
+
+    def _fetch_page(self, prefix: str, params: dict[str, str]):
+        session = self.session or get_transport()
+        with tracey.span("list", cat="http", prefix=prefix), session.get(
+            f"{self.base_url}/", params=params, stream=True
+        ) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            return parse_listing_page(response.raw)
+
+    def _fetch(self, prefix: str) -> list[BucketObject]:
+        objects: list[BucketObject] = []
+        params = {"prefix": prefix}
+        while True:
+            page, truncated, next_marker = get_transport().retrying(
+                functools.partial(self._fetch_page, prefix, params), what=f"listing of {prefix}"
+            )
+            objects.extend(page)
+            if not truncated or not page:
+                return objects
+            # V1 listings only include `NextMarker` when a delimiter is given; otherwise the
+            # last key is the marker.
+            params = {"prefix": prefix, "marker": next_marker or page[-1].key}
+
+    def list(self, prefix: str) -> list[BucketObject]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(prefix)
+            if cached and now - cached[0] < self.ttl:
+                return cached[1]
+        objects = self._fetch(prefix)
+        with self._lock:
+            self._cache[prefix] = (time.monotonic(), objects)
+        return objects
+
+    def list_many(self, prefixes: list[str]) -> dict[str, list[BucketObject]]:
+        prefixes = list(dict.fromkeys(prefixes))
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(prefixes)))) as pool:
+            return dict(zip(prefixes, pool.map(self.list, prefixes)))
+
+    def invalidate(self, prefix: str | None = None) -> None:
+        with self._lock:
+            if prefix is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(prefix, None)
+
+
+shared_lister = BucketLister()
@@ -0,0 +1,199 @@
+from __future__ import annotations
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import benchy
+from cachey import BlobCache
+from httpy import RetryPolicy, configure_transport
+from standiny import FaultConfig, StandIn
+import tracey
+import uploady
+
+PLATFORM_TAGS = ["linux_x86_64", "linux_aarch64", "macosx_10_15_x86_64", "macosx_11_0_arm64"]
+
+
+def populate(
+    standin: StandIn,
+    workdir: str,
+    *,
+    releases: int,
+    platforms: int,
+    pypi_platforms: int,
+    scale: float,
+    existing: bool,
+) -> list[str]:
+    # Each release gets `platforms` locally-versioned wheels in the bucket; the first
+    # `pypi_platforms` of them also have their final wheel on PyPI, like a published release.
+    # With `existing`, every final wheel is already an asset, as if a previous run finished.
+    shape = next(s for s in benchy.SHAPES if s.name == "huge-native")
+    tags = []
+    for i in range(releases):
+        version = f"2.99.0.dev{i}"
+        tag_name = f"release_{version}"
+        release = standin.add_release(tag_name)
+        for j, platform_tag in enumerate(PLATFORM_TAGS[:platforms]):
+            local = benchy.make_wheel(
+                workdir, shape, scale=scale, seed=i * 100 + j, version=f"{version}+git{release.sha[:8]}", platform_tag=platform_tag
+            )
+            filename = os.path.basename(local)
+            with open(local, "rb") as f:
+                standin.add_object(f"wheels/pantsbuild.pants/{release.sha}/{version}/{filename}", f.read())
+            os.remove(local)
+
+            final = benchy.make_wheel(
+                workdir,
+                shape,
+                scale=scale,
+                seed=i * 100 + j,
+                version=version,
+                platform_tag=platform_tag.replace("linux_", "manylinux2014_"),
+            )
+            with open(final, "rb") as f:
+                data = f.read()
+            os.remove(final)
+            if j < pypi_platforms:
+                standin.add_pypi_file("pantsbuild.pants", version, os.path.basename(final), data)
+                if existing:
+                    standin.add_asset(tag_name, os.path.basename(final), data)
+        tags.append(tag_name)
+    return tags
+
+
+def run(args: argparse.Namespace) -> dict:
+    faults = FaultConfig(
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        truncate_rate=args.truncate_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory() as tmp, StandIn(faults, page_size=args.page_size) as standin:
+        fixtures = os.path.join(tmp, "fixtures")
+        workdir = os.path.join(tmp, "work")
+        os.makedirs(fixtures)
+        os.makedirs(workdir)
+        tags = populate(
+            standin,
+            fixtures,
+            releases=args.releases,
+            platforms=args.platforms,
+            pypi_platforms=args.pypi_platforms,
+            scale=args.scale,
+            existing=args.existing,
+        )
+        transport = configure_transport(
+            url_map=standin.url_map(), retry_policy=RetryPolicy(base_delay=args.retry_base_delay)
+        )
+        # N.B.: The stand-in's PyGithub client doesn't retry on its own, so its lookups go through
+        # the transport's retries like everything else, or injected faults would fail the harness.
+        repo = transport.retrying(lambda: standin.github().get_repo("pantsbuild/pants"), what="lookup of pantsbuild/pants")
+        cache = BlobCache(os.path.join(tmp, "cache"), max_bytes=1 << 40) if args.cache else None
+
+        # Retries are whatever the client actually counted; we need a tracer for that even when
+        # the run isn't traced.
+        tracer = tracey.get_tracer() or tracey.enable()
+        runs = []
+        for attempt in range(args.runs):
+            before = standin.stats.as_dict()
+            retries_before = sum(value for name, value in tracer.counters.items() if name.startswith("retries."))
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            start = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(sys.stderr if args.verbose else open(os.devnull, "w")):
+                    summaries = uploady.main(
+                        tags,
+                        repo=repo,
+                        token="stand-in-token",
+                        release_workers=args.release_workers,
+                        download_workers=args.download_workers,
+                        reversion_workers=args.reversion_workers,
+                        upload_workers=args.upload_workers,
+                        cache=cache,
+                        relay=args.relay,
+                    )
+            finally:
+                os.chdir(cwd)
+            wall = time.perf_counter() - start
+            after = standin.stats.as_dict()
+            retries_after = sum(value for name, value in tracer.counters.items() if name.startswith("retries."))
+            runs.append(
+                {
+                    "run": attempt,
+                    "wall_seconds": wall,
+                    "bytes_downloaded": after["bytes_sent"] - before["bytes_sent"],
+                    "bytes_uploaded": after["bytes_received"] - before["bytes_received"],
+                    "requests": after["total_requests"] - before["total_requests"],
+                    "retries": retries_after - retries_before,
+                    "injected_faults": sum(
+                        after[key] - before[key]
+                        for key in ("injected_errors", "injected_truncations", "injected_rate_limits")
+                    ),
+                    "failed_releases": [s.version for s in summaries if s.error],
+                    "uploaded": sum(len(s.uploaded) for s in summaries),
+                    "skipped": sum(len(s.skipped) for s in summaries),
+                }
+            )
+        return {
+            "config": {key: value for key, value in vars(args).items() if key != "json"},
+            "runs": runs,
+            "connections": [
+                {"host": s.host, "requests": s.requests, "connections": s.connections}
+                for s in transport.stats()
+            ],
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive whole uploady runs against local GitHub/S3/PyPI stand-ins and report throughput."
+    )
+    parser.add_argument("--releases", type=int, default=3)
+    parser.add_argument("--platforms", type=int, default=4, choices=range(1, len(PLATFORM_TAGS) + 1))
+    parser.add_argument("--pypi-platforms", type=int, default=1, help="How many platforms per release are already on PyPI.")
+    parser.add_argument("--existing", action="store_true", help="Pre-populate the PyPI wheels as release assets.")
+    parser.add_argument("--scale", type=float, default=0.1, help="Wheel size scale, see benchy.py.")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="Bytes per second per connection; 0 is unlimited.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of GitHub requests refused with a 403.")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After sent with those refusals.")
+    parser.add_argument("--retry-base-delay", type=float, default=0.05)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=1, help="Repeat the whole upload, e.g. to measure warm re-runs.")
+    parser.add_argument("--cache", action="store_true", help="Use a (fresh) wheel cache shared across runs.")
+    parser.add_argument("--release-workers", type=int, default=2)
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--reversion-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--relay", action="store_true", help="Relay PyPI wheels instead of downloading them.")
+    parser.add_argument("--json", help="Also write the report to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Show the scripts' own output on stderr.")
+    tracey.add_trace_args(parser)
+    args = parser.parse_args()
+
+    tracey.enable_from_args(args)
+    report = run(args)
+    for r in report["runs"]:
+        print(
+            f"run {r['run']}: {r['wall_seconds']:.2f}s, {r['bytes_downloaded'] / 1e6:.1f} MB down, "
+            f"{r['bytes_uploaded'] / 1e6:.1f} MB up, {r['requests']} requests, {r['retries']} retries for {r['injected_faults']} injected fault(s), "
+            f"{r['uploaded']} uploaded, {r['skipped']} skipped"
+            + (f", FAILED: {', '.join(r['failed_releases'])}" if r["failed_releases"] else "")
+        )
+    for c in report["connections"]:
+        print(f"{c['host']}: {c['requests']} request(s) over {c['connections']} connection(s)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    tracey.write_from_args(args)
+    sys.exit(1 if any(r["failed_releases"] for r in report["runs"]) else 0)
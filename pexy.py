@@ -1,26 +1,227 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 import os
+import re
+import shutil
 import subprocess
-from xml.etree import ElementTree
-import github
-import requests
-import urllib
+import sys
+import tempfile
+import threading
+import time
 
+from cachey import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, BlobCache, cache_key, sha256_file
+from downloady import download
+from githuby import get_repo, get_token
+from httpy import get_transport
+from listy import shared_lister as lister
+import startupy
+import tracey
 
 
-def _github():
-    token = subprocess.run(
-        ["gh", "auth", "token"], check=True, text=True, capture_output=True
-    ).stdout.strip()
-    return github.Github(auth=github.Auth.Token(token)), token
+DEFAULT_BUILD_WORKERS = 4
+DEFAULT_PEX_ROOT = os.path.join(DEFAULT_CACHE_DIR, "pex")
+DEFAULT_WHEELHOUSE = os.path.join(DEFAULT_CACHE_DIR, "wheelhouse")
+DEFAULT_PREFETCH_WORKERS = 8
+DEFAULT_BUILD_CACHE = os.path.join(DEFAULT_CACHE_DIR, "pex-builds")
+PANTS_WHEELS_INDEX = "https://wheels.pantsbuild.org/simple"
 
-gh, token = _github()
-repo = gh.get_repo("pantsbuild/pants")
+@dataclass(frozen=True)
+class PexBuild:
+    pex_name: str
+    platform: str
+    returncode: int
+    elapsed: float
+    output: str = ""
+    cached: bool = False
+    upload_error: str | None = None
 
-def do_one(release):
+    @property
+    def built(self) -> bool:
+        return self.returncode == 0 and os.path.exists(self.pex_name)
+
+    @property
+    def ok(self) -> bool:
+        return self.built and self.upload_error is None
+
+    def describe(self) -> str:
+        if self.cached:
+            description = f"{self.pex_name} [{self.platform}]: reused cached build"
+        else:
+            status = "OK" if self.built else f"FAILED (exit {self.returncode})"
+            description = f"{self.pex_name} [{self.platform}]: {status} in {self.elapsed:.1f}s"
+        if self.upload_error is not None:
+            description += f", upload FAILED: {self.upload_error}"
+        return description
+
+
+@dataclass(frozen=True)
+class WheelInput:
+    filename: str
+    url: str
+    # The S3 ETag or release asset id, so a re-published wheel is a different input.
+    tag: str | None
+
+    def store_path(self, wheelhouse) -> str:
+        # Stored by source rather than by filename alone: the same filename under two 3rdparty
+        # prefixes (or re-published) isn't necessarily the same wheel.
+        return os.path.join(wheelhouse, "by-source", cache_key(self.url, self.tag or "")[:16], self.filename)
+
+
+def wheel_matches_platform(filename, platform, pyver) -> bool:
+    # Loose compatibility check, used only to decide what to prefetch: over-including a wheel
+    # costs a download, under-including one leaves `resolve_closure` to fetch it from an index.
+    parts = filename[: -len(".whl")].split("-")
+    if len(parts) < 5:
+        return False
+    abis = parts[-2].split(".")
+    plats = parts[-1].split(".")
+    if not {"none", "abi3", pyver} & set(abis):
+        return False
+    if platform.startswith("macosx"):
+        arch = re.sub(r"^macosx_\d+_\d+_", "", platform)
+        return any(
+            plat == "any"
+            or (plat.startswith("macosx") and (plat.endswith(f"_{arch}") or "universal" in plat))
+            for plat in plats
+        )
+    arch = platform[len("linux_"):]
+    return any(plat == "any" or (plat.endswith(f"_{arch}") and "linux" in plat) for plat in plats)
+
+def prefetch_wheelhouse(inputs, wheelhouse, *, workers: int = DEFAULT_PREFETCH_WORKERS):
+    # The store is shared across releases and runs, so only wheels we haven't seen before get
+    # downloaded. Builds never resolve from it directly; see `wheelhouse_view`.
+    missing = {i.store_path(wheelhouse): i for i in inputs if not os.path.exists(i.store_path(wheelhouse))}
+    print(f"Prefetching {len(missing)} of {len(inputs)} wheel(s) into {wheelhouse}")
+
+    def fetch(item):
+        path, wheel = item
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        result = download(wheel.url, tmp)
+        os.replace(tmp, path)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(fetch, missing.items()))
+
+def wheelhouse_view(inputs, wheelhouse, name) -> str:
+    # A fresh directory of hard links to exactly one build's inputs, so it can't resolve another
+    # release's wheels out of the shared store.
+    views = os.path.join(wheelhouse, "views")
+    os.makedirs(views, exist_ok=True)
+    view = tempfile.mkdtemp(prefix=f"{name}.", dir=views)
+    for wheel in inputs:
+        try:
+            os.link(wheel.store_path(wheelhouse), os.path.join(view, wheel.filename))
+        except OSError:
+            shutil.copyfile(wheel.store_path(wheelhouse), os.path.join(view, wheel.filename))
+    return view
+
+def resolve_closure(view, *, version, wheel_platform, pyver) -> subprocess.CompletedProcess:
+    # Completes a build's view with the rest of what `pantsbuild.pants==version` needs on its
+    # platform, from the same indexes the remote build resolves against, so that the build itself
+    # can run with `--no-index`. Wheels already in the view are used as they are.
+    return subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "pip",
+            "download",
+            "--quiet",
+            "--dest",
+            view,
+            "--only-binary",
+            ":all:",
+            "--platform",
+            wheel_platform,
+            "--implementation",
+            "cp",
+            "--python-version",
+            f"{pyver[2]}.{pyver[3:]}",
+            "--abi",
+            pyver,
+            "-f",
+            view,
+            "-f",
+            PANTS_WHEELS_INDEX,
+            f"pantsbuild.pants=={version}",
+        ],
+        text=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+
+def build_key(*, version, platform, pyver, closure: dict[str, str]) -> str:
+    # `closure` maps every wheel in a resolved view to its sha256. The build runs with
+    # `--no-index` against exactly those, so they're everything it resolves from.
+    return cache_key(
+        "pex",
+        version,
+        platform,
+        pyver,
+        *sorted(f"{filename}={sha256}" for filename, sha256 in closure.items()),
+    )
+
+def build_pex(pex_name, *, version, platform, pyver, pex_root, wheelhouse=None) -> PexBuild:
+    print(f"TRYING TO BUILD: {pex_name}")
+    if wheelhouse:
+        # Hermetic: `wheelhouse` already holds the whole closure (see `resolve_closure`).
+        repos = ["--no-index", "-f", wheelhouse]
+    else:
+        repos = ["-f", PANTS_WHEELS_INDEX, "-f", "links.html"]
+    start = time.perf_counter()
+    result = subprocess.run(
+        [
+            "pex",
+            "--pex-root",
+            pex_root,
+            "--python-shebang",
+            "/usr/bin/env python",
+            "-o",
+            pex_name,
+            *repos,
+            f"pantsbuild.pants=={version}",
+            "--no-build",
+            "--no-strip-pex-env",
+            "--console-script=pants",
+            "--venv",
+            f"--platform={platform}-cp-{pyver[2:]}-{pyver}",
+        ],
+        text=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    build = PexBuild(pex_name, platform, result.returncode, time.perf_counter() - start, result.stdout)
+    print(build.describe())
+    if not build.built:
+        print(build.output)
+    return build
+
+def upload_pex(release, pex_name):
+    print(f"Uploading {pex_name}")
+    def upload():
+        with open(pex_name, "rb") as f:
+            response = get_transport().put(f"https://uploads.github.com/repos/pantsbuild/pants/releases/{release.id}/assets", params={"name": pex_name}, headers={"Content-Type": "application/octet-stream", "Authorization": f"Bearer {get_token()}"}, data=f)
+            response.raise_for_status()
+    get_transport().retrying(upload, what=f"upload of {pex_name}", counter="retries.upload")
+    tracey.count("bytes.uploaded", os.path.getsize(pex_name))
+
+def do_one(
+    release,
+    *,
+    build_workers: int = DEFAULT_BUILD_WORKERS,
+    pex_root: str = DEFAULT_PEX_ROOT,
+    wheelhouse: str | None = DEFAULT_WHEELHOUSE,
+    prefetch_workers: int = DEFAULT_PREFETCH_WORKERS,
+    build_cache: BlobCache | None = None,
+):
     tag = release.tag_name
     prefix, _, version = release.tag_name.partition("_")
 
-    assets = {asset.name for asset in release.assets}
+    asset_urls = {asset.name: asset.browser_download_url for asset in release.assets}
+    asset_ids = {asset.name: str(asset.id) for asset in release.assets}
+    assets = set(asset_urls)
 
     USES_PYTHON_39 = int(version.split(".")[1]) >= 5  # Pants 2.5 was Py 3.9
     pyver = "cp39" if USES_PYTHON_39 else "cp38"
@@ -37,95 +238,106 @@ def do_one(release):
         key: value for key, value in wheel_to_pex_map.items() if key in assets
     }
 
+    repo = get_repo()
     commit_sha = repo._requester.requestJsonAndCheck("GET", f"{repo.url}/git/refs/tags/{tag}")[1]["object"]["sha"]
 
+    prefixes = [
+        f"wheels/3rdparty/{commit_sha[:8]}",
+        # AHA!
+        "wheels/3rdparty/852f420",
+        "wheels/3rdparty/869d82ed",
+        "wheels/3rdparty/e338a90a",
+    ]
     try:
-        list_bucket_results = requests.get(f"https://binaries.pantsbuild.org?prefix=wheels/3rdparty/{commit_sha[:8]}").content
+        listings = lister.list_many(prefixes)
     except Exception:
         commit_sha = repo._requester.requestJsonAndCheck("GET", f"{repo.url}/git/tags/{tag}")[1]['object']["sha"]
-        list_bucket_results = requests.get(f"https://binaries.pantsbuild.org?prefix=wheels/3rdparty/{commit_sha[:8]}").content
-
-    with open("links.html", "w") as fp:
-        # N.B.: S3 bucket listings use a default namespace. Although the URI is apparently stable,
-        # we decouple from it with the wildcard.
-        for key in ElementTree.fromstring(list_bucket_results).findall("./{*}Contents/{*}Key"):
-            bucket_path = str(key.text)
-            fp.write(
-                f'<a href="https://binaries.pantsbuild.org/{urllib.parse.quote(bucket_path)}">'
-                f"{os.path.basename(bucket_path)}"
-                f"</a>\n"
-            )
+        prefixes[0] = f"wheels/3rdparty/{commit_sha[:8]}"
+        listings = lister.list_many(prefixes)
 
-        # AHA!
-        list_bucket_results = requests.get("https://binaries.pantsbuild.org/?prefix=wheels/3rdparty/852f420").content
-        for key in ElementTree.fromstring(list_bucket_results).findall("./{*}Contents/{*}Key"):
-            bucket_path = str(key.text)
-            fp.write(
-                f'<a href="https://binaries.pantsbuild.org/{urllib.parse.quote(bucket_path)}">'
-                f"{os.path.basename(bucket_path)}"
-                f"</a>\n"
-            )
-        # AHA!
-        list_bucket_results = requests.get("https://binaries.pantsbuild.org/?prefix=wheels/3rdparty/869d82ed").content
-        for key in ElementTree.fromstring(list_bucket_results).findall("./{*}Contents/{*}Key"):
-            bucket_path = str(key.text)
-            fp.write(
-                f'<a href="https://binaries.pantsbuild.org/{urllib.parse.quote(bucket_path)}">'
-                f"{os.path.basename(bucket_path)}"
-                f"</a>\n"
-            )
-        # AHA!
-        list_bucket_results = requests.get("https://binaries.pantsbuild.org/?prefix=wheels/3rdparty/e338a90a").content
-        for key in ElementTree.fromstring(list_bucket_results).findall("./{*}Contents/{*}Key"):
-            bucket_path = str(key.text)
-            fp.write(
-                f'<a href="https://binaries.pantsbuild.org/{urllib.parse.quote(bucket_path)}">'
-                f"{os.path.basename(bucket_path)}"
-                f"</a>\n"
-            )
+    if not wheelhouse:
+        with open("links.html", "w") as fp:
+            for prefix in prefixes:
+                for obj in listings[prefix]:
+                    fp.write(f'<a href="{obj.url}">{obj.basename}</a>\n')
 
-        fp.flush()
+            fp.flush()
 
+    # Several wheels can map to the same pex (e.g. both macOS x86_64 wheels); the first one wins.
+    # Each build sees exactly its pants wheel plus the 3rdparty wheels for its platform, the
+    # release's own prefix winning when two prefixes hold the same filename.
+    pex_to_platform = {}
+    wheel_platforms = {}
+    build_inputs = {}
     for wheel_name, pex_name in wheel_to_pex_map.items():
-        if pex_name in assets:
+        if pex_name in assets or pex_name in pex_to_platform:
             continue
+        wheel_platforms[pex_name] = wheel_name.rsplit(".", 1)[0].rsplit("-", 1)[-1]
+        platform = wheel_platforms[pex_name].replace("manylinux2014", "linux")
+        pex_to_platform[pex_name] = platform
+        inputs = {wheel_name: WheelInput(wheel_name, asset_urls[wheel_name], asset_ids[wheel_name])}
+        for prefix in prefixes:
+            for obj in listings[prefix]:
+                if obj.key.endswith(".whl") and wheel_matches_platform(obj.basename, platform, pyver):
+                    inputs.setdefault(obj.basename, WheelInput(obj.basename, obj.url, obj.etag))
+        build_inputs[pex_name] = list(inputs.values())
 
-        platform = wheel_name.rsplit(".", 1)[0].rsplit("-", 1)[-1].replace("manylinux2014", "linux")
-        print(f"TRYING TO BUILD: {pex_name}")
-        subprocess.run(
-            [
-                "pex",
-                "--disable-cache",
-                "--python-shebang",
-                "/usr/bin/env python",
-                "-o",
-                pex_name,
-                "-f",
-                "https://wheels.pantsbuild.org/simple",
-                "-f",
-                "links.html",
-                f"pantsbuild.pants=={version}",
-                "--no-build",
-                "--disable-cache",
-                "--no-strip-pex-env",
-                "--console-script=pants",
-                "--venv",
-                f"--platform={platform}-cp-{pyver[2:]}-{pyver}",
-            ],
-        )
-
-        if not os.path.exists(pex_name):
-            continue
+    if wheelhouse:
+        needed = {wheel.store_path(wheelhouse): wheel for pex_name in pex_to_platform for wheel in build_inputs[pex_name]}
+        with tracey.span("prefetch", cat="stage", release=tag, wheels=len(needed)):
+            prefetch_wheelhouse(list(needed.values()), wheelhouse, workers=prefetch_workers)
+    elif build_cache is not None:
+        # A remote resolve can change from one run to the next, so there's nothing to key it on.
+        print("Not using the build cache: it needs --wheelhouse")
+        build_cache = None
 
-        print(f"Uploading {pex_name}")
-        for retry in range(5):
+    def build_and_upload(pex_name):
+        platform = pex_to_platform[pex_name]
+        build = None
+        key = None
+        view = wheelhouse_view(build_inputs[pex_name], wheelhouse, pex_name) if wheelhouse else None
+        try:
+            if view:
+                start = time.perf_counter()
+                with tracey.span("resolve", cat="stage", item=pex_name):
+                    result = resolve_closure(view, version=version, wheel_platform=wheel_platforms[pex_name], pyver=pyver)
+                if result.returncode != 0:
+                    build = PexBuild(pex_name, platform, result.returncode, time.perf_counter() - start, result.stdout)
+                    print(f"Failed to resolve the closure of {pex_name}:\n{build.output}")
+                elif build_cache is not None:
+                    # Reuse an earlier build of exactly the same closure.
+                    key = build_key(
+                        version=version,
+                        platform=platform,
+                        pyver=pyver,
+                        closure={filename: sha256_file(os.path.join(view, filename)) for filename in os.listdir(view)},
+                    )
+                    if build_cache.get(key, pex_name):
+                        build = PexBuild(pex_name, platform, 0, 0.0, cached=True)
+                        print(build.describe())
+                        tracey.count("pex.cache_hits")
+            if build is None:
+                with tracey.span("build", cat="stage", item=pex_name):
+                    build = build_pex(
+                        pex_name, version=version, platform=platform, pyver=pyver, pex_root=pex_root, wheelhouse=view
+                    )
+                if build.built and key is not None:
+                    build_cache.put(key, pex_name)
+        finally:
+            if view:
+                shutil.rmtree(view, ignore_errors=True)
+        if build.built:
+            # Recorded rather than raised, so one failed upload doesn't lose every other build.
             try:
-                with open(pex_name, "rb") as f:
-                    response = requests.put(f"https://uploads.github.com/repos/pantsbuild/pants/releases/{release.id}/assets", params={"name": pex_name}, headers={"Content-Type": "application/octet-stream", "Authorization": f"Bearer {token}"}, data=f)
-                    response.raise_for_status()
-                break
-            except Exception:
-                continue
+                with tracey.span("upload", cat="stage", item=pex_name):
+                    upload_pex(release, pex_name)
+            except Exception as e:
+                build = replace(build, upload_error=str(e))
+                print(build.describe())
+        return build
+
+    with ThreadPoolExecutor(max_workers=max(1, build_workers)) as pool:
+        return list(pool.map(build_and_upload, pex_to_platform))
 
 versions = {
 "release_2.17.0.dev2",
@@ -133,14 +345,66 @@ versions = {
 "release_2.17.0.dev0",
 }
 
-def main():
+def main(tags=(), **build_opts):
     #releases = repo.get_releases()
 
-    for release_tag in versions:
-        release = repo.get_release(release_tag)
+    builds = []
+    for release_tag in tags or versions:
+        release = get_repo().get_release(release_tag)
+
+        builds.extend(do_one(release, **build_opts))
 
-        do_one(release)
+    print(get_transport().describe_stats())
+    for build in builds:
+        print(build.describe())
+    return builds
 
 if __name__ == "__main__":
+    import argparse
     import sys
-    main()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tags", nargs="*", help="Release tags to build pexes for.")
+    parser.add_argument("--build-workers", type=int, default=DEFAULT_BUILD_WORKERS)
+    parser.add_argument(
+        "--pex-root",
+        default=DEFAULT_PEX_ROOT,
+        help="pex/pip cache shared by every build, across releases and runs.",
+    )
+    parser.add_argument(
+        "--wheelhouse",
+        default=DEFAULT_WHEELHOUSE,
+        help="Directory to prefetch the bucket's wheels into. Each build gets its own closure and resolves with --no-index.",
+    )
+    parser.add_argument(
+        "--no-wheelhouse",
+        dest="wheelhouse",
+        action="store_const",
+        const=None,
+        help="Resolve against the remote indexes instead of a prefetched wheelhouse.",
+    )
+    parser.add_argument("--prefetch-workers", type=int, default=DEFAULT_PREFETCH_WORKERS)
+    parser.add_argument(
+        "--build-cache-dir",
+        default=DEFAULT_BUILD_CACHE,
+        help="Built pexes, keyed by their version, platform and resolved closure, reused by later runs.",
+    )
+    parser.add_argument("--build-cache-max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--no-build-cache", dest="build_cache_dir", action="store_const", const=None)
+    tracey.add_trace_args(parser)
+    startupy.add_startup_args(parser)
+    startupy.exit_if_profiling("pexy")
+    args = parser.parse_args()
+    tracey.enable_from_args(args)
+    builds = main(
+        args.tags,
+        build_workers=args.build_workers,
+        pex_root=args.pex_root,
+        wheelhouse=args.wheelhouse,
+        prefetch_workers=args.prefetch_workers,
+        build_cache=(
+            BlobCache(args.build_cache_dir, max_bytes=args.build_cache_max_bytes) if args.build_cache_dir else None
+        ),
+    )
+    tracey.write_from_args(args)
+    sys.exit(0 if all(build.ok for build in builds) else 1)
@@ -0,0 +1,153 @@
+from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from dataclasses import dataclass
+import heapq
+import itertools
+from typing import Any, Callable, Iterable
+
+import tracey
+from tracey import Tracer
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+    # CPU-bound stages run in a process pool so they don't fight the I/O stages for the GIL.
+    # Their `fn` and values must be picklable.
+    processes: bool = False
+
+
+@dataclass
+class PipelineFailure:
+    item: Any
+    stage: str
+    error: BaseException
+
+
+class PipelineError(Exception):
+    def __init__(self, failures: list[PipelineFailure]):
+        self.failures = failures
+        super().__init__(
+            "{} item(s) failed:\n{}".format(
+                len(failures),
+                "\n".join(f"  [{f.stage}] {f.item!r}: {f.error!r}" for f in failures),
+            )
+        )
+
+
+# Forking while other threads hold locks (sqlite's, an HTTP pool's) can deadlock the child, and
+# the I/O stages are always running threads, so start workers from a clean server process.
+# Process pools (and multiprocessing with them) are only imported once a pipeline needs one.
+def _process_pool(workers: int) -> Executor:
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    return ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context("forkserver"))
+
+
+def _invoke(fn: Callable[[Any], Any], value: Any, name: str, label: str) -> Any:
+    with tracey.span(name, cat="stage", item=label):
+        return fn(value)
+
+def _invoke_in_process(fn: Callable[[Any], Any], value: Any, name: str, label: str, trace: bool) -> tuple:
+    # Worker processes can't reach the parent's tracer, so record into a fresh one and ship its
+    # events back with the result.
+    if not trace:
+        return fn(value), [], {}
+    tracer = Tracer()
+    previous = tracey.swap(tracer)
+    try:
+        with tracer.span(name, cat="stage", item=label):
+            result = fn(value)
+    finally:
+        tracey.swap(previous)
+    return result, tracer.events, dict(tracer.counters)
+
+
+def run_pipeline(
+    items: Iterable[Any],
+    stages: list[Stage],
+    *,
+    label: Callable[[Any], str] = repr,
+    priority: Callable[[Any], float] | None = None,
+) -> list[Any]:
+    # Each item flows through the stages in order, but different items occupy different stages
+    # at the same time. Every stage gets its own pool, so `Stage.workers` bounds that stage's
+    # concurrency independently of the others.
+    #
+    # Items wait here rather than in the pools' own FIFO queues, so that with `priority` each
+    # stage starts on its highest-priority waiting item first (e.g. the largest, so the long
+    # transfers don't end up as the tail of the run). Without it, items go in arrival order.
+    items = list(items)
+    if not stages:
+        return items
+    results: list[Any] = [None] * len(items)
+    failures: list[PipelineFailure] = []
+    with ExitStack() as stack:
+        executors: list[Executor] = [
+            stack.enter_context(
+                _process_pool(stage.workers)
+                if stage.processes
+                else ThreadPoolExecutor(max_workers=max(1, stage.workers))
+            )
+            for stage in stages
+        ]
+        pending: dict[Future, tuple[int, int]] = {}
+        waiting: list[list[tuple[float, int, int, Any]]] = [[] for _ in stages]
+        running = [0] * len(stages)
+        arrivals = itertools.count()
+        tracer = tracey.get_tracer()
+
+        def dispatch(stage_index: int) -> None:
+            stage = stages[stage_index]
+            while waiting[stage_index] and running[stage_index] < max(1, stage.workers):
+                _, _, index, value = heapq.heappop(waiting[stage_index])
+                if stage.processes:
+                    future = executors[stage_index].submit(
+                        _invoke_in_process, stage.fn, value, stage.name, label(items[index]), tracer is not None
+                    )
+                else:
+                    future = executors[stage_index].submit(_invoke, stage.fn, value, stage.name, label(items[index]))
+                pending[future] = (index, stage_index)
+                running[stage_index] += 1
+
+        def enqueue(index: int, stage_index: int, value: Any) -> None:
+            rank = -priority(items[index]) if priority else 0
+            heapq.heappush(waiting[stage_index], (rank, next(arrivals), index, value))
+            tracey.gauge(f"queue.{stages[stage_index].name}", len(waiting[stage_index]) + running[stage_index])
+
+        # Queue every item before starting any, so the first ones started are the highest priority.
+        for index, item in enumerate(items):
+            enqueue(index, 0, item)
+        dispatch(0)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, stage_index = pending.pop(future)
+                running[stage_index] -= 1
+                tracey.gauge(
+                    f"queue.{stages[stage_index].name}", len(waiting[stage_index]) + running[stage_index]
+                )
+                dispatch(stage_index)
+                try:
+                    value = future.result()
+                    if stages[stage_index].processes:
+                        value, events, counters = value
+                        if tracer is not None:
+                            tracer.merge(events, counters)
+                except Exception as e:
+                    failures.append(PipelineFailure(items[index], stages[stage_index].name, e))
+                    continue
+                if stage_index + 1 == len(stages):
+                    results[index] = value
+                else:
+                    enqueue(index, stage_index + 1, value)
+                    dispatch(stage_index + 1)
+
+    if failures:
+        raise PipelineError(failures)
+    return results
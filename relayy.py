@@ -0,0 +1,149 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import hashlib
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Callable
+
+from downloady import DEFAULT_CHUNK_SIZE, ChecksumMismatch, DownloadError
+from httpy import get_transport
+import tracey
+
+if TYPE_CHECKING:
+    import requests
+
+# Relays a download straight into an upload without touching disk. The download runs on its own
+# thread and hands chunks over through a bounded queue, so at most `buffer_chunks * chunk_size`
+# bytes are held in memory and a slow side only ever stalls the other one.
+
+DEFAULT_BUFFER_CHUNKS = 8
+_EOF = object()
+
+
+class NotRelayable(DownloadError):
+    # The source didn't say how big it is; GitHub uploads need a Content-Length up front.
+    pass
+
+
+@dataclass(frozen=True)
+class RelayResult:
+    url: str
+    size: int
+    sha256: str
+    elapsed: float
+
+    def describe(self) -> str:
+        rate = self.size / self.elapsed / 1e6 if self.elapsed else float("inf")
+        return f"relayed {self.size / 1e6:.1f} MB in {self.elapsed:.2f}s ({rate:.1f} MB/s)"
+
+
+class RelayBody:
+    # A file-like request body. `requests` sends it with our Content-Length (from `__len__`) and
+    # `http.client` pulls it with `read()`. The digest is checked before the last bytes are handed
+    # out, so a corrupt download fails the upload instead of completing it.
+
+    def __init__(
+        self,
+        response: requests.Response,
+        *,
+        size: int,
+        sha256: str | None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        buffer_chunks: int = DEFAULT_BUFFER_CHUNKS,
+    ):
+        self.url = response.url
+        self.size = size
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        self.hasher = hashlib.sha256()
+        self.received = 0
+        self._pending = memoryview(b"")
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, buffer_chunks))
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._pump, args=(response, chunk_size), daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        # Gives up once the upload side is gone, rather than blocking on a full queue forever.
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _pump(self, response: requests.Response, chunk_size: int) -> None:
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not self._put(chunk):
+                    return
+            self._put(_EOF)
+        except BaseException as e:
+            self._put(e)
+
+    def _next_chunk(self) -> bytes:
+        item = self._queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        if item is _EOF:
+            if self.received != self.size:
+                raise DownloadError(f"{self.url} ended after {self.received} of {self.size} bytes")
+            return b""
+        self.received += len(item)
+        self.hasher.update(item)
+        if self.received > self.size:
+            raise DownloadError(f"{self.url} sent more than its Content-Length of {self.size} bytes")
+        if self.received == self.size and self.expected_sha256:
+            digest = self.hasher.hexdigest()
+            if digest != self.expected_sha256:
+                raise ChecksumMismatch(f"sha256 of {self.url} was {digest}, expected {self.expected_sha256}")
+        return item
+
+    def read(self, n: int = -1) -> bytes:
+        if not self._pending:
+            self._pending = memoryview(self._next_chunk())
+        if n is None or n < 0:
+            n = len(self._pending)
+        data, self._pending = self._pending[:n], self._pending[n:]
+        return bytes(data)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        while chunk := self.read():
+            yield chunk
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+
+
+def relay(
+    url: str,
+    send: Callable[[RelayBody], None],
+    *,
+    sha256: str | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    buffer_chunks: int = DEFAULT_BUFFER_CHUNKS,
+) -> RelayResult:
+    # Downloads `url` and hands the body to `send`, which should upload it and raise if that
+    # fails. Raises `NotRelayable` before sending anything if the size isn't known up front.
+    start = time.perf_counter()
+    # Ask for the bytes as stored: a decoded body wouldn't match the Content-Length.
+    with get_transport().get(url, stream=True, headers={"Accept-Encoding": "identity"}) as response:
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        if size is None or response.headers.get("Content-Encoding", "identity") != "identity":
+            raise NotRelayable(f"{url} has no usable Content-Length")
+        body = RelayBody(
+            response, size=int(size), sha256=sha256, chunk_size=chunk_size, buffer_chunks=buffer_chunks
+        )
+        try:
+            with tracey.span("relay", cat="http", url=url, size=body.size):
+                send(body)
+        finally:
+            body.close()
+    tracey.count("bytes.relayed", body.size)
+    return RelayResult(url, body.size, body.hasher.hexdigest(), time.perf_counter() - start)
@@ -0,0 +1,199 @@
+from __future__ import annotations
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+import io
+import os
+import re
+import zipfile
+
+from downloady import DownloadError
+from httpy import get_transport
+import tracey
+from wheely import locate_dist_info_member_dir, read_member_version
+
+# Reads a remote zip (a wheel in the S3 bucket, on PyPI or attached to a GitHub release) through
+# HTTP `Range` requests, so `zipfile` can list it and read selected members without downloading
+# the rest. The first request takes the tail of the file, which holds the end-of-central-directory
+# record and, for all but the biggest wheels, the whole central directory; METADATA and RECORD
+# then usually cost one small request each.
+
+DEFAULT_TAIL_SIZE = 64 * 1024
+DEFAULT_BLOCK_SIZE = 64 * 1024
+# Fetched spans kept besides the tail. zipfile reads members a few kB at a time, so this is what
+# keeps a member read from costing a request per read.
+DEFAULT_MAX_SPANS = 16
+
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+
+class RangeNotSupported(DownloadError):
+    # The server answered a ranged request with the whole file, which is what we're avoiding.
+    pass
+
+
+class RemoteFile(io.RawIOBase):
+    # A read-only, seekable file over `url`. Reads are served from fetched spans where possible;
+    # anything else fetches at least `block_size` bytes from the read position onwards.
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        headers: dict[str, str] | None = None,
+        tail_size: int = DEFAULT_TAIL_SIZE,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        max_spans: int = DEFAULT_MAX_SPANS,
+    ):
+        super().__init__()
+        self.url = url
+        self.name = url
+        self.headers = dict(headers or {})
+        self.block_size = block_size
+        self.max_spans = max_spans
+        self.requests = 0
+        self.bytes_fetched = 0
+        self._pos = 0
+        self._spans: OrderedDict[int, bytes] = OrderedDict()
+        start, data, self.size = self._fetch(f"bytes=-{tail_size}", accept_whole=tail_size)
+        self._tail = (start, data)
+
+    def _fetch(self, byte_range: str, *, accept_whole: int = 0) -> tuple[int, bytes, int]:
+        # Returns `(start, data, total size)`. A server that ignores the range is only tolerated
+        # when the whole file is no bigger than `accept_whole`.
+        def get():
+            headers = {**self.headers, "Range": byte_range, "Accept-Encoding": "identity"}
+            with get_transport().get(self.url, headers=headers, stream=True) as response:
+                if response.status_code == 200:
+                    length = response.headers.get("Content-Length")
+                    if length is None or int(length) > accept_whole:
+                        raise RangeNotSupported(f"{self.url} ignored `Range: {byte_range}`")
+                    data = response.content
+                    return 0, data, len(data)
+                response.raise_for_status()
+                match = _CONTENT_RANGE_RE.fullmatch(response.headers.get("Content-Range", ""))
+                if response.status_code != 206 or not match:
+                    raise DownloadError(f"Unexpected response to `Range: {byte_range}` from {self.url}")
+                data = response.content
+                if len(data) != int(match[2]) - int(match[1]) + 1:
+                    raise DownloadError(f"Short range read from {self.url}")
+                return int(match[1]), data, int(match[3])
+
+        start, data, total = get_transport().retrying(get, what=f"GET {byte_range} of {self.url}")
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        tracey.count("bytes.ranged", len(data))
+        return start, data, total
+
+    def _span_at(self, pos: int) -> tuple[int, bytes] | None:
+        start, data = self._tail
+        if start <= pos < start + len(data):
+            return self._tail
+        for start, data in self._spans.items():
+            if start <= pos < start + len(data):
+                self._spans.move_to_end(start)
+                return start, data
+        return None
+
+    def read(self, n: int = -1) -> bytes:
+        end = self.size if n is None or n < 0 else min(self.size, self._pos + n)
+        parts = []
+        while self._pos < end:
+            span = self._span_at(self._pos)
+            if span is None:
+                want = max(end - self._pos, self.block_size)
+                start, data, _ = self._fetch(f"bytes={self._pos}-{min(self.size, self._pos + want) - 1}")
+                self._spans[start] = data
+                while len(self._spans) > self.max_spans:
+                    self._spans.popitem(last=False)
+                span = start, data
+            start, data = span
+            chunk = data[self._pos - start : end - start]
+            parts.append(chunk)
+            self._pos += len(chunk)
+        return b"".join(parts)
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+@contextmanager
+def open_remote_zip(url: str, *, headers: dict[str, str] | None = None):
+    with RemoteFile(url, headers=headers) as f, zipfile.ZipFile(f) as zf:
+        yield zf
+
+
+@dataclass(frozen=True)
+class RemoteWheel:
+    url: str
+    size: int
+    names: list[str]
+    version: str
+    record: str
+    requests: int
+    bytes_fetched: int
+
+    def describe(self) -> str:
+        return (
+            f"{self.url.rsplit('/', 1)[-1]}: version {self.version}, {len(self.names)} member(s), "
+            f"{self.size / 1e6:.1f} MB; read {self.bytes_fetched / 1e3:.1f} kB in {self.requests} request(s)"
+        )
+
+
+def inspect_wheel(url: str, *, headers: dict[str, str] | None = None) -> RemoteWheel:
+    # For a GitHub release asset, pass its `browser_download_url`, or for a private one its API
+    # `url` with `Accept: application/octet-stream` and an `Authorization` header.
+    with tracey.span("inspect", cat="http", url=url), RemoteFile(url, headers=headers) as f:
+        with zipfile.ZipFile(f) as whl:
+            names = whl.namelist()
+            dist_info_dir = locate_dist_info_member_dir(names)
+            version = read_member_version(whl, f"{dist_info_dir}/METADATA")
+            record = whl.read(f"{dist_info_dir}/RECORD").decode("utf-8")
+        return RemoteWheel(url, f.size, names, version, record, f.requests, f.bytes_fetched)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Inspect remote wheels without downloading them.")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--members", action="store_true", help="Also list every member.")
+    parser.add_argument("--record", action="store_true", help="Also print RECORD.")
+    args = parser.parse_args()
+    failed = False
+    for url in args.urls:
+        try:
+            wheel = inspect_wheel(url)
+        except Exception as e:
+            print(f"{url}: {e}")
+            failed = True
+            continue
+        print(wheel.describe())
+        if args.members:
+            for name in wheel.names:
+                print(f"  {name}")
+        if args.record:
+            print(wheel.record)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,405 @@
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass, field
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from xml.sax.saxutils import escape
+
+# A local stand-in for the GitHub releases/assets API, the binaries.pantsbuild.org S3 bucket
+# listing and the PyPI JSON API, with knobs for latency, bandwidth and injected failures. Point
+# the scripts at it with `StandIn.url_map()` (see `httpy.Transport`) and a PyGithub client from
+# `StandIn.github()`.
+
+_CHUNK = 64 * 1024
+
+
+@dataclass
+class FaultConfig:
+    # Seconds added before every response.
+    latency: float = 0.0
+    # Bytes per second for response and request bodies; 0 means unlimited.
+    bandwidth: float = 0.0
+    # Probability that a request fails with a 500 before doing anything.
+    error_rate: float = 0.0
+    # Probability that a body download is cut off halfway through.
+    truncate_rate: float = 0.0
+    # Probability that a GitHub request is refused with a secondary rate limit.
+    rate_limit_rate: float = 0.0
+    # The `Retry-After` sent with those refusals.
+    retry_after: float = 1.0
+    seed: int = 0
+
+
+@dataclass
+class Asset:
+    id: int
+    name: str
+    data: bytes
+    # GitHub keeps a "starter" asset when an upload fails partway.
+    state: str = "uploaded"
+
+    @property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+
+@dataclass
+class Release:
+    id: int
+    tag_name: str
+    sha: str
+    assets: dict[str, Asset] = field(default_factory=dict)
+
+
+@dataclass
+class Stats:
+    requests: Counter = field(default_factory=Counter)
+    injected_errors: int = 0
+    injected_truncations: int = 0
+    injected_rate_limits: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": dict(self.requests),
+            "total_requests": sum(self.requests.values()),
+            "injected_errors": self.injected_errors,
+            "injected_truncations": self.injected_truncations,
+            "injected_rate_limits": self.injected_rate_limits,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+class StandIn:
+    def __init__(self, faults: FaultConfig | None = None, *, page_size: int = 1000):
+        self.faults = faults or FaultConfig()
+        self.page_size = page_size
+        self.releases: dict[str, Release] = {}
+        self.objects: dict[str, bytes] = {}
+        self.pypi: dict[tuple[str, str], dict[str, bytes]] = {}
+        self.stats = Stats()
+        self._ids = iter(range(1, 1 << 31))
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.faults.seed)
+        self._server: http.server.ThreadingHTTPServer | None = None
+
+    # Fixtures.
+
+    def add_release(self, tag_name: str, sha: str | None = None) -> Release:
+        sha = sha or hashlib.sha1(tag_name.encode()).hexdigest()
+        release = Release(next(self._ids), tag_name, sha)
+        self.releases[tag_name] = release
+        return release
+
+    def add_asset(self, tag_name: str, name: str, data: bytes) -> Asset:
+        asset = Asset(next(self._ids), name, data)
+        self.releases[tag_name].assets[name] = asset
+        return asset
+
+    def add_object(self, key: str, data: bytes) -> None:
+        self.objects[key] = data
+
+    def add_pypi_file(self, package: str, version: str, filename: str, data: bytes) -> None:
+        self.pypi.setdefault((package, version), {})[filename] = data
+
+    # Serving.
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None, "StandIn is not running."
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_map(self) -> dict[str, str]:
+        return {
+            "https://api.github.com": f"{self.url}/github-api",
+            "https://uploads.github.com": f"{self.url}/github-uploads",
+            "https://binaries.pantsbuild.org": f"{self.url}/s3",
+            "https://pypi.org": f"{self.url}/pypi",
+        }
+
+    def github(self, token: str = "stand-in-token"):
+        import github
+
+        return github.Github(base_url=f"{self.url}/github-api", auth=github.Auth.Token(token), retry=None)
+
+    def start(self) -> StandIn:
+        standin = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.standin = standin
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> StandIn:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._rng.random() < rate
+
+    # JSON shapes, trimmed to what the scripts and PyGithub read.
+
+    def _asset_json(self, release: Release, asset: Asset) -> dict:
+        return {
+            "id": asset.id,
+            "name": asset.name,
+            "size": len(asset.data),
+            "digest": f"sha256:{asset.sha256}",
+            "state": asset.state,
+            "url": f"{self.url}/github-api/repos/pantsbuild/pants/releases/assets/{asset.id}",
+            "browser_download_url": f"{self.url}/github-downloads/{release.tag_name}/{asset.name}",
+        }
+
+    def _release_json(self, release: Release) -> dict:
+        return {
+            "id": release.id,
+            "tag_name": release.tag_name,
+            "name": release.tag_name,
+            "draft": False,
+            "prerelease": False,
+            "url": f"{self.url}/github-api/repos/pantsbuild/pants/releases/{release.id}",
+            "upload_url": f"{self.url}/github-uploads/repos/pantsbuild/pants/releases/{release.id}/assets{{?name,label}}",
+            "assets": [self._asset_json(release, asset) for asset in release.assets.values()],
+        }
+
+    def _repo_json(self) -> dict:
+        return {
+            "id": 1,
+            "name": "pants",
+            "full_name": "pantsbuild/pants",
+            "url": f"{self.url}/github-api/repos/pantsbuild/pants",
+        }
+
+    def _listing_xml(self, prefix: str, marker: str) -> bytes:
+        keys = sorted(key for key in self.objects if key.startswith(prefix) and key > marker)
+        page = keys[: self.page_size]
+        contents = "".join(
+            f"<Contents><Key>{escape(key)}</Key>"
+            f"<ETag>&quot;{hashlib.md5(self.objects[key]).hexdigest()}&quot;</ETag>"
+            f"<Size>{len(self.objects[key])}</Size></Contents>"
+            for key in page
+        )
+        truncated = "true" if len(keys) > len(page) else "false"
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Prefix>{escape(prefix)}</Prefix><IsTruncated>{truncated}</IsTruncated>{contents}"
+            "</ListBucketResult>"
+        ).encode()
+
+    def _pypi_json(self, package: str, version: str) -> dict | None:
+        files = self.pypi.get((package, version))
+        if files is None:
+            return None
+        return {
+            "urls": [
+                {
+                    "filename": filename,
+                    "url": f"{self.url}/pypi-files/{urllib.parse.quote(filename)}",
+                    "digests": {"sha256": hashlib.sha256(data).hexdigest()},
+                    "size": len(data),
+                }
+                for filename, data in files.items()
+            ]
+        }
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    standin: StandIn
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _throttle(self, nbytes: int) -> None:
+        bandwidth = self.standin.faults.bandwidth
+        if bandwidth:
+            time.sleep(nbytes / bandwidth)
+
+    def _read_body(self) -> bytes:
+        remaining = int(self.headers.get("Content-Length") or 0)
+        chunks = []
+        while remaining:
+            chunk = self.rfile.read(min(_CHUNK, remaining))
+            if not chunk:
+                break
+            self._throttle(len(chunk))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        body = b"".join(chunks)
+        with self.standin._lock:
+            self.standin.stats.bytes_received += len(body)
+        return body
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers=None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        truncate = len(body) > 1 and self.standin._roll(self.standin.faults.truncate_rate)
+        if truncate:
+            with self.standin._lock:
+                self.standin.stats.injected_truncations += 1
+            body = body[: len(body) // 2]
+        for i in range(0, len(body), _CHUNK):
+            chunk = body[i : i + _CHUNK]
+            self._throttle(len(chunk))
+            self.wfile.write(chunk)
+            with self.standin._lock:
+                self.standin.stats.bytes_sent += len(chunk)
+        if truncate:
+            self.wfile.flush()
+            self.close_connection = True
+
+    def _send_json(self, status: int, payload) -> None:
+        self._send(status, json.dumps(payload).encode())
+
+    def _send_bytes(self, data: bytes) -> None:
+        # Supports the single `bytes=N-` / `bytes=N-M` ranges the downloader and range reader use.
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if not match:
+            self._send(200, data, "application/octet-stream", {"Accept-Ranges": "bytes"})
+            return
+        start, end = match.groups()
+        if not start:
+            start, end = max(0, len(data) - int(end)), len(data) - 1
+        start = int(start)
+        end = min(int(end) if end else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            self._send(416, b"", headers={"Content-Range": f"bytes */{len(data)}"})
+            return
+        self._send(
+            206,
+            data[start : end + 1],
+            "application/octet-stream",
+            {"Content-Range": f"bytes {start}-{end}/{len(data)}", "Accept-Ranges": "bytes"},
+        )
+
+    def _handle(self) -> None:
+        standin = self.standin
+        parsed = urllib.parse.urlparse(self.path)
+        path = urllib.parse.unquote(parsed.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        route = path.split("/", 2)[1] if path.count("/") >= 1 else ""
+        with standin._lock:
+            standin.stats.requests[f"{self.command} {route}"] += 1
+        body = self._read_body() if self.command in ("POST", "PUT", "PATCH") else b""
+        if len(body) < int(self.headers.get("Content-Length") or 0):
+            # The client gave up mid-body; like GitHub, don't act on a partial upload.
+            self.close_connection = True
+            return
+
+        if standin.faults.latency:
+            time.sleep(standin.faults.latency)
+        if standin._roll(standin.faults.error_rate):
+            with standin._lock:
+                standin.stats.injected_errors += 1
+            self._send_json(500, {"message": "Injected failure"})
+            return
+        if route.startswith("github") and standin._roll(standin.faults.rate_limit_rate):
+            with standin._lock:
+                standin.stats.injected_rate_limits += 1
+            self._send(
+                403,
+                json.dumps({"message": "You have exceeded a secondary rate limit."}).encode(),
+                headers={"Retry-After": f"{standin.faults.retry_after:g}"},
+            )
+            return
+
+        repo = "/github-api/repos/pantsbuild/pants"
+        if path == repo:
+            return self._send_json(200, standin._repo_json())
+        if m := re.fullmatch(rf"{repo}/commits/(.+)", path):
+            release = standin.releases.get(m.group(1))
+            return self._send_json(200, {"sha": release.sha}) if release else self._send_json(404, {})
+        if m := re.fullmatch(rf"{repo}/git/refs/tags/(.+)", path):
+            release = standin.releases.get(m.group(1))
+            if not release:
+                return self._send_json(404, {})
+            return self._send_json(200, {"object": {"sha": release.sha, "type": "commit"}})
+        if m := re.fullmatch(rf"{repo}/releases/tags/(.+)", path):
+            release = standin.releases.get(m.group(1))
+            return self._send_json(200, standin._release_json(release)) if release else self._send_json(404, {})
+        if path == f"{repo}/releases" and self.command == "GET":
+            page = int(query.get("page", 1))
+            per_page = int(query.get("per_page", 30))
+            releases = list(standin.releases.values())[(page - 1) * per_page : page * per_page]
+            return self._send_json(200, [standin._release_json(release) for release in releases])
+        if path == f"{repo}/releases" and self.command == "POST":
+            tag_name = json.loads(body)["tag_name"]
+            release = standin.releases.get(tag_name) or standin.add_release(tag_name)
+            return self._send_json(201, standin._release_json(release))
+        if m := re.fullmatch(rf"{repo}/releases/(\d+)/assets", path):
+            release = next((r for r in standin.releases.values() if r.id == int(m.group(1))), None)
+            if not release:
+                return self._send_json(404, {})
+            page = int(query.get("page", 1))
+            per_page = int(query.get("per_page", 30))
+            assets = list(release.assets.values())[(page - 1) * per_page : page * per_page]
+            return self._send_json(200, [standin._asset_json(release, asset) for asset in assets])
+        if m := re.fullmatch(rf"{repo}/releases/assets/(\d+)", path):
+            for release in standin.releases.values():
+                for name, asset in list(release.assets.items()):
+                    if asset.id == int(m.group(1)):
+                        if self.command == "DELETE":
+                            del release.assets[name]
+                            return self._send(204)
+                        return self._send_json(200, standin._asset_json(release, asset))
+            return self._send_json(404, {})
+        if m := re.fullmatch(r"/github-uploads/repos/pantsbuild/pants/releases/(\d+)/assets", path):
+            release = next((r for r in standin.releases.values() if r.id == int(m.group(1))), None)
+            name = query.get("name")
+            if not release or not name:
+                return self._send_json(404, {})
+            if name in release.assets:
+                return self._send_json(422, {"message": "already_exists"})
+            asset = standin.add_asset(release.tag_name, name, body)
+            return self._send_json(201, standin._asset_json(release, asset))
+        if m := re.fullmatch(r"/github-downloads/([^/]+)/(.+)", path):
+            release = standin.releases.get(m.group(1))
+            asset = release.assets.get(m.group(2)) if release else None
+            return self._send_bytes(asset.data) if asset else self._send(404)
+        if path in ("/s3", "/s3/"):
+            return self._send(
+                200, standin._listing_xml(query.get("prefix", ""), query.get("marker", "")), "application/xml"
+            )
+        if path.startswith("/s3/"):
+            data = standin.objects.get(path[len("/s3/"):])
+            return self._send_bytes(data) if data is not None else self._send(404)
+        if m := re.fullmatch(r"/pypi/pypi/([^/]+)/([^/]+)/json", path):
+            payload = standin._pypi_json(m.group(1), m.group(2))
+            return self._send_json(200, payload) if payload else self._send_json(404, {"message": "Not Found"})
+        if m := re.fullmatch(r"/pypi-files/(.+)", path):
+            for files in standin.pypi.values():
+                if m.group(1) in files:
+                    return self._send_bytes(files[m.group(1)])
+            return self._send(404)
+        self._send_json(404, {"message": f"No stand-in route for {self.command} {path}"})
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import argparse
+from contextlib import contextmanager
+import os
+import subprocess
+import sys
+import time
+
+import tracey
+
+# Startup accounting for the CLI entry points. `phase()` times the lazy, expensive bits of
+# initialisation (the `gh` subprocess, importing PyGithub) wherever they end up happening, and
+# `report()` combines those with an `-X importtime` profile of the entry point's own imports.
+
+_phases: list[tuple[str, float]] = []
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        with tracey.span(name, cat="startup"):
+            yield
+    finally:
+        _phases.append((name, time.perf_counter() - start))
+
+
+def process_age() -> float | None:
+    # Seconds since this process started, including interpreter startup. Linux only.
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+def import_profile(module: str) -> list[tuple[str, float, float]]:
+    # (module, self ms, cumulative ms) for every import `import <module>` triggers, measured in a
+    # fresh interpreter so it reflects a cold start rather than this process's warm caches.
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return rows
+
+def report(module: str, *, top: int = 15) -> str:
+    lines = []
+    age = process_age()
+    if age is not None:
+        lines.append(f"Process age at report: {age * 1000:.0f} ms")
+    profile = import_profile(module)
+    total = next((cumulative for name, _, cumulative in profile if name == module), None)
+    if total is not None:
+        lines.append(f"Cold `import {module}`: {total:.1f} ms")
+    heavy = [name for name in ("github", "requests", "urllib3", "cryptography") if name in sys.modules]
+    lines.append(f"Heavy packages imported so far: {', '.join(heavy) or 'none'}")
+    if _phases:
+        lines.append("Lazy setup:")
+    for name, seconds in _phases:
+        lines.append(f"  {name}: {seconds * 1000:.1f} ms")
+    lines.append("Slowest imports (cumulative ms, self ms):")
+    for name, self_ms, cumulative_ms in sorted(profile, key=lambda row: -row[2])[:top]:
+        lines.append(f"  {cumulative_ms:8.1f} {self_ms:8.1f}  {name}")
+    return "\n".join(lines)
+
+
+def add_startup_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report what starting this tool costs (imports, lazy client setup) and exit.",
+    )
+
+def exit_if_profiling(module: str, argv: list[str] | None = None) -> None:
+    # Checked ahead of `parse_args()` so the report works without the tool's required arguments.
+    if "--profile-startup" in (sys.argv[1:] if argv is None else argv):
+        # Every one of these tools starts by looking up the repo, so do that too: it's what pays
+        # for the `gh auth token` and `import github` phases.
+        import githuby
+
+        try:
+            with phase("get_repo"):
+                githuby.get_repo()
+        except Exception as e:
+            print(f"Looking up the repo failed, so the lazy setup below is partial: {e!r}")
+        print(report(module))
+        sys.exit(0)
@@ -0,0 +1,138 @@
+from __future__ import annotations
+import argparse
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import threading
+import time
+
+# Lightweight spans and counters for the release scripts. Everything is a no-op until `enable()`
+# is called: `span()` then costs one global lookup and hands back a shared null context.
+#
+# Events follow the Chrome trace-event format, so the same list can be dumped as JSON lines or
+# loaded into chrome://tracing or Perfetto.
+
+_NULL = nullcontext()
+
+
+def _now_us() -> int:
+    return time.time_ns() // 1000
+
+
+class Tracer:
+    def __init__(self):
+        self.events: list[dict] = []
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _emit(self, event: dict) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "", **args):
+        start = _now_us()
+        start_perf = time.perf_counter_ns()
+        try:
+            yield
+        except BaseException as e:
+            args["error"] = repr(e)
+            raise
+        finally:
+            self._emit(
+                {
+                    "name": name,
+                    "cat": cat,
+                    "ph": "X",
+                    "ts": start,
+                    "dur": (time.perf_counter_ns() - start_perf) // 1000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+            total = self.counters[name]
+        self._emit({"name": name, "ph": "C", "ts": _now_us(), "pid": os.getpid(), "args": {name: total}})
+
+    def gauge(self, name: str, value: float) -> None:
+        self._emit({"name": name, "ph": "C", "ts": _now_us(), "pid": os.getpid(), "args": {name: value}})
+
+    def merge(self, events: list[dict], counters: dict[str, int]) -> None:
+        # Folds in what a tracer in another process recorded. Its counter events carry that
+        # process's own running totals, so replay the increments here instead.
+        with self._lock:
+            self.events.extend(event for event in events if event["ph"] != "C")
+        for name, value in counters.items():
+            self.count(name, value)
+
+    def write_jsonl(self, path: str) -> None:
+        with open(path, "w") as f:
+            for event in self.events:
+                f.write(json.dumps(event))
+                f.write("\n")
+
+    def write_chrome(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+_tracer: Tracer | None = None
+
+def enable(tracer: Tracer | None = None) -> Tracer:
+    global _tracer
+    _tracer = tracer or Tracer()
+    return _tracer
+
+def disable() -> None:
+    global _tracer
+    _tracer = None
+
+def swap(tracer: Tracer | None) -> Tracer | None:
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+def get_tracer() -> Tracer | None:
+    return _tracer
+
+def span(name: str, cat: str = "", **args):
+    tracer = _tracer
+    if tracer is None:
+        return _NULL
+    return tracer.span(name, cat, **args)
+
+def count(name: str, value: int = 1) -> None:
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, value)
+
+def gauge(name: str, value: float) -> None:
+    tracer = _tracer
+    if tracer is not None:
+        tracer.gauge(name, value)
+
+
+def add_trace_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--trace-jsonl", help="Write spans and counters to this file as JSON lines.")
+    parser.add_argument("--trace-chrome", help="Write spans and counters to this file in Chrome trace-event format.")
+
+def enable_from_args(args: argparse.Namespace) -> Tracer | None:
+    if args.trace_jsonl or args.trace_chrome:
+        return enable()
+    return None
+
+def write_from_args(args: argparse.Namespace) -> None:
+    tracer = _tracer
+    if tracer is None:
+        return
+    if args.trace_jsonl:
+        tracer.write_jsonl(args.trace_jsonl)
+    if args.trace_chrome:
+        tracer.write_chrome(args.trace_chrome)
+    for name, value in sorted(tracer.counters.items()):
+        print(f"{name}: {value}")
@@ -0,0 +1,998 @@
+from __future__ import annotations
+import argparse
+import base64
+import collections
+from contextlib import ExitStack, contextmanager
+import copy
+import csv
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import errno
+import fnmatch
+import functools
+import glob
+import hashlib
+import io
+import json
+from pathlib import Path
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from typing import Callable
+import zipfile
+import zlib
+
+from cachey import BlobCache, sha256_file, cache_key
+import tracey
+
+_version_re = re.compile(r"Version: (?P<version>\S+)")
+
+
+@contextmanager
+def open_zip(path_or_file, *args, **kwargs) :
+    if not path_or_file:
+        raise Exception(f"Invalid zip location: {path_or_file}")
+    if "allowZip64" not in kwargs:
+        kwargs["allowZip64"] = True
+    try:
+        zf = zipfile.ZipFile(path_or_file, *args, **kwargs)
+    except zipfile.BadZipfile as bze:
+        # Use the realpath in order to follow symlinks back to the problem source file.
+        raise zipfile.BadZipfile(f"Bad Zipfile {os.path.realpath(path_or_file)}: {bze}")
+    try:
+        yield zf
+    finally:
+        zf.close()
+
+def locate_dist_info_dir(workspace):
+    dir_suffix = "*.dist-info"
+    matches = glob.glob(os.path.join(workspace, dir_suffix))
+    if not matches:
+        raise Exception("Unable to locate `{}` directory in input whl.".format(dir_suffix))
+    if len(matches) > 1:
+        raise Exception("Too many `{}` directories in input whl: {}".format(dir_suffix, matches))
+    return os.path.relpath(matches[0], workspace)
+
+def any_match(globs, filename):
+    return any(fnmatch.fnmatch(filename, g) for g in globs)
+
+def read_file(filename: str, binary_mode: bool = False) -> bytes | str:
+    mode = "rb" if binary_mode else "r"
+    with open(filename, mode) as f:
+        content: bytes | str = f.read()
+        return content
+
+def safe_delete(filename: str | Path) -> None:
+    try:
+        os.unlink(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def safe_rmtree(directory: str | Path) -> None:
+    if os.path.islink(directory):
+        safe_delete(directory)
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def safe_mkdir(directory: str | Path, clean: bool = False) -> None:
+    if clean:
+        safe_rmtree(directory)
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def safe_mkdir_for(path: str | Path, clean: bool = False) -> None:
+    dirname = os.path.dirname(path)
+    if dirname:
+        safe_mkdir(dirname, clean=clean)
+
+def safe_open(filename, *args, **kwargs):
+    safe_mkdir_for(filename)
+    return open(filename, *args, **kwargs)
+
+def safe_file_dump(
+    filename: str, payload: bytes | str = "", mode: str = "w", makedirs: bool = False
+) -> None:
+    if makedirs:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with safe_open(filename, mode=mode) as f:
+        f.write(payload)
+
+_COPY_BUFSIZE = 1024 * 1024
+
+def iter_replace_segments(read: Callable[[int], bytes], needle: bytes, *, bufsize: int = _COPY_BUFSIZE):
+    # Splits a stream around the occurrences of `needle` that `bytes.replace` would replace:
+    # yields runs of untouched bytes, and None in place of each occurrence. Only the last
+    # `len(needle) - 1` bytes of a read are carried into the next, which is enough to catch an
+    # occurrence straddling two reads and keeps memory at about `bufsize` whatever the size.
+    if not needle:
+        raise ValueError("Cannot search for an empty string.")
+    keep = len(needle) - 1
+    buf = b""
+    while True:
+        chunk = read(bufsize)
+        buf = buf + chunk if buf else chunk
+        pos = 0
+        while (i := buf.find(needle, pos)) >= 0:
+            if i > pos:
+                yield buf[pos:i]
+            yield None
+            pos = i + len(needle)
+        end = max(pos, len(buf) - keep) if chunk else len(buf)
+        if end > pos:
+            yield buf[pos:end]
+        buf = buf[end:]
+        if not chunk:
+            return
+
+def stream_contains(read: Callable[[int], bytes], needle: bytes, *, bufsize: int = _COPY_BUFSIZE) -> bool:
+    return any(segment is None for segment in iter_replace_segments(read, needle, bufsize=bufsize))
+
+def stream_replace_to_many(
+    read: Callable[[int], bytes],
+    outputs: list[tuple[bytes, Callable[[bytes], object]]],
+    from_bytes: bytes,
+    *,
+    bufsize: int = _COPY_BUFSIZE,
+) -> list[tuple[str, str]]:
+    # Writes the stream to every `(to_bytes, write)` output with `from_bytes` replaced by that
+    # output's `to_bytes`, reading the input once. Returns each output's RECORD fingerprint,
+    # hashed as it is written.
+    hashers = [hashlib.sha256() for _ in outputs]
+    sizes = [0] * len(outputs)
+    for segment in iter_replace_segments(read, from_bytes, bufsize=bufsize):
+        for n, (to_bytes, write) in enumerate(outputs):
+            data = to_bytes if segment is None else segment
+            write(data)
+            hashers[n].update(data)
+            sizes[n] += len(data)
+    return [_record_digest(hasher, size) for hasher, size in zip(hashers, sizes)]
+
+def stream_replace(
+    read: Callable[[int], bytes], write: Callable[[bytes], object], from_bytes: bytes, to_bytes: bytes
+) -> tuple[str, str]:
+    return stream_replace_to_many(read, [(to_bytes, write)], from_bytes)[0]
+
+def replace_in_file(workspace, src_file_path, from_str, to_str):
+    from_bytes = from_str.encode("ascii")
+    to_bytes = to_str.encode("ascii")
+    src = os.path.join(workspace, src_file_path)
+    if from_str not in src_file_path:
+        with open(src, "rb") as f:
+            if not stream_contains(f.read, from_bytes):
+                return None
+
+    dst_file_path = src_file_path.replace(from_str, to_str)
+    dst = os.path.join(workspace, dst_file_path)
+    # The source and destination may be the same file, so write alongside and swap it in.
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    with open(src, "rb") as fin, safe_open(tmp, "wb") as fout:
+        stream_replace(fin.read, fout.write, from_bytes, to_bytes)
+    os.replace(tmp, dst)
+    if src_file_path != dst_file_path:
+        os.unlink(src)
+    return dst_file_path
+
+def _record_digest(hasher, size: int) -> tuple[str, str]:
+    record_encoded = base64.urlsafe_b64encode(hasher.digest()).rstrip(b"=")
+    return f"sha256={record_encoded.decode()}", str(size)
+
+def fingerprint_file(workspace, filename):
+    hasher = hashlib.sha256()
+    size = 0
+    with open(os.path.join(workspace, filename), "rb") as f:
+        while chunk := f.read(_COPY_BUFSIZE):
+            hasher.update(chunk)
+            size += len(chunk)
+    return _record_digest(hasher, size)
+
+def rewrite_record_file(workspace, src_record_file, mutated_file_tuples):
+    mutated_files = set()
+    dst_record_file = None
+    for src, dst in mutated_file_tuples:
+        if src == src_record_file:
+            dst_record_file = dst
+        else:
+            mutated_files.add(dst)
+    if not dst_record_file:
+        raise Exception(
+            "Malformed whl or bad globs: `{}` was not rewritten.".format(src_record_file)
+        )
+
+    output_records = []
+    file_name = os.path.join(workspace, dst_record_file)
+    for line in read_file(file_name).splitlines():
+        filename, fingerprint_str, size_str = line.rsplit(",", 3)
+        if filename in mutated_files:
+            fingerprint_str, size_str = fingerprint_file(workspace, filename)
+            output_line = ",".join((filename, fingerprint_str, size_str))
+        else:
+            output_line = line
+        output_records.append(output_line)
+
+    safe_file_dump(file_name, "\r\n".join(output_records) + "\r\n")
+
+def extract_reversion(
+    *,
+    whl_file: str,
+    dest_dir: str,
+    target_version: str,
+    extra_globs: list[str] | None = None,
+    compression: Compression | None = None,
+) -> str:
+    compression = compression or Compression()
+    all_globs = ["*.dist-info/*", "*-nspkg.pth", *(extra_globs or ())]
+    with tempfile.TemporaryDirectory() as workspace:
+        # Extract the input.
+        with open_zip(whl_file, "r") as whl:
+            src_filenames = whl.namelist()
+            whl.extractall(workspace)
+
+        # Determine the location of the `dist-info` directory.
+        dist_info_dir = locate_dist_info_dir(workspace)
+        record_file = os.path.join(dist_info_dir, "RECORD")
+
+        # Get version from the input whl's metadata.
+        input_version = None
+        metadata_file = os.path.join(workspace, dist_info_dir, "METADATA")
+        with open(metadata_file, "r") as info:
+            for line in info:
+                mo = _version_re.match(line)
+                if mo:
+                    input_version = mo.group("version")
+                    break
+        if not input_version:
+            raise Exception("Could not find `Version:` line in {}".format(metadata_file))
+
+        # Rewrite and move all files (including the RECORD file), recording which files need to be
+        # re-fingerprinted due to content changes.
+        dst_filenames = []
+        refingerprint = []
+        for src_filename in src_filenames:
+            if os.path.isdir(os.path.join(workspace, src_filename)):
+                continue
+            dst_filename = src_filename
+            if any_match(all_globs, src_filename):
+                rewritten = replace_in_file(workspace, src_filename, input_version, target_version)
+                if rewritten is not None:
+                    dst_filename = rewritten
+                    refingerprint.append((src_filename, dst_filename))
+            dst_filenames.append(dst_filename)
+
+        # Refingerprint relevant entries in the RECORD file under their new names.
+        rewrite_record_file(workspace, record_file, refingerprint)
+
+        # Create a new output whl in the destination.
+        dst_whl_filename = os.path.basename(whl_file).replace(input_version, target_version)
+        dst_whl_file = os.path.join(dest_dir, dst_whl_filename)
+        stats = CompressionStats()
+        with tempfile.TemporaryDirectory() as chroot:
+            tmp_whl_file = os.path.join(chroot, dst_whl_filename)
+
+            def compress(dst_filename: str) -> Callable[[], None]:
+                path = os.path.join(workspace, dst_filename)
+                member = MemberCompressor(
+                    zipfile.ZipInfo.from_file(path, dst_filename),
+                    level=compression.level,
+                    store=compression.stores(dst_filename),
+                )
+                with open(path, "rb") as f:
+                    while chunk := f.read(_COPY_BUFSIZE):
+                        member.write(chunk)
+                member.finish()
+
+                def append() -> None:
+                    member.append_to(whl)
+                    stats.add(member)
+                return append
+
+            with open_zip(tmp_whl_file, "w", zipfile.ZIP_DEFLATED) as whl, OrderedWriter(compression.workers) as writer:
+                for dst_filename in dst_filenames:
+                    writer.submit(compress, dst_filename)
+            check_wheel(tmp_whl_file)
+            shutil.move(tmp_whl_file, dst_whl_file)
+        print(f"{dst_whl_filename}: {stats.describe()}")
+        print("Wrote whl with version {} to {}.\n".format(target_version, dst_whl_file))
+    return dst_whl_file
+
+
+def record_fingerprint(content: bytes) -> tuple[str, str]:
+    return _record_digest(hashlib.sha256(content), len(content))
+
+def locate_dist_info_member_dir(names):
+    dir_suffix = ".dist-info"
+    matches = sorted({name.split("/", 1)[0] for name in names if name.split("/", 1)[0].endswith(dir_suffix) and "/" in name})
+    if not matches:
+        raise Exception("Unable to locate `*{}` directory in input whl.".format(dir_suffix))
+    if len(matches) > 1:
+        raise Exception("Too many `*{}` directories in input whl: {}".format(dir_suffix, matches))
+    return matches[0]
+
+def read_member_version(whl: zipfile.ZipFile, metadata_name: str) -> str:
+    for line in whl.read(metadata_name).decode("utf-8").splitlines():
+        mo = _version_re.match(line)
+        if mo:
+            return mo.group("version")
+    raise Exception("Could not find `Version:` line in {}".format(metadata_name))
+
+def rewrite_record(record: bytes, fingerprints: dict[str, tuple[str, str]]) -> bytes:
+    output_records = []
+    for line in record.decode("utf-8").splitlines():
+        filename, fingerprint_str, size_str = line.rsplit(",", 2)
+        if filename in fingerprints:
+            output_records.append(",".join((filename, *fingerprints[filename])))
+        else:
+            output_records.append(line)
+    return ("\r\n".join(output_records) + "\r\n").encode("utf-8")
+
+def _strip_zip64_extra(extra: bytes) -> bytes:
+    # `ZipInfo.FileHeader` appends its own zip64 field when needed, so drop any we inherited.
+    fields = []
+    i = 0
+    while i + 4 <= len(extra):
+        tag, size = struct.unpack("<HH", extra[i : i + 4])
+        if tag != 1:
+            fields.append(extra[i : i + 4 + size])
+        i += 4 + size
+    return b"".join(fields)
+
+def copy_raw_member(src: zipfile.ZipFile, dst: zipfile.ZipFile, info: zipfile.ZipInfo) -> None:
+    copy_raw_member_to_many(src, [dst], info)
+
+def copy_raw_member_to_many(src: zipfile.ZipFile, dsts: list[zipfile.ZipFile], info: zipfile.ZipInfo) -> None:
+    # N.B.: zipfile has no public API for copying a member without recompressing it, so this
+    # skips past the source local header and appends to each of `dsts` the same way
+    # `ZipFile.write` does. The compressed bytes are read once however many outputs there are.
+    if info.flag_bits & 0x01:
+        raise zipfile.BadZipfile(f"Refusing to copy encrypted member {info.filename}")
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipfile(f"Bad local file header for {info.filename}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    src.fp.seek(name_len + extra_len, os.SEEK_CUR)
+
+    outs = []
+    for dst in dsts:
+        out = copy.copy(info)
+        # We know the sizes and CRC up front, so write them in the local header instead of
+        # trailing a data descriptor.
+        out.flag_bits &= ~0x08
+        out.extra = _strip_zip64_extra(info.extra)
+        out.header_offset = dst.fp.tell()
+        dst.fp.write(out.FileHeader())
+        outs.append(out)
+    remaining = info.compress_size
+    while remaining:
+        chunk = src.fp.read(min(remaining, _COPY_BUFSIZE))
+        if not chunk:
+            raise zipfile.BadZipfile(f"Truncated data for {info.filename}")
+        for dst in dsts:
+            dst.fp.write(chunk)
+        remaining -= len(chunk)
+    for dst, out in zip(dsts, outs):
+        _register_member(dst, out)
+
+def _register_member(dst: zipfile.ZipFile, info: zipfile.ZipInfo) -> None:
+    # The central directory bookkeeping `ZipFile` does after writing a member itself.
+    dst.filelist.append(info)
+    dst.NameToInfo[info.filename] = info
+    dst.start_dir = dst.fp.tell()
+    dst._didModify = True
+
+def _rewritten_info(info: zipfile.ZipInfo, name: str) -> zipfile.ZipInfo:
+    zinfo = zipfile.ZipInfo(name, date_time=info.date_time)
+    zinfo.external_attr = info.external_attr
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    return zinfo
+
+DEFAULT_COMPRESS_LEVEL = 6
+# Compressed members bigger than this spill to disk while they wait their turn to be written.
+_SPOOL_SIZE = 8 * _COPY_BUFSIZE
+
+
+@dataclass(frozen=True)
+class Compression:
+    # How `reversion` compresses the members it writes. Members the streaming mode copies through
+    # untouched keep whatever compression the input wheel gave them.
+    level: int = DEFAULT_COMPRESS_LEVEL
+    # Members matching these are stored rather than deflated, for payloads that are already
+    # compressed. `("*",)` stores everything.
+    store_globs: tuple[str, ...] = ()
+    workers: int | None = None
+
+    def stores(self, filename: str) -> bool:
+        return any_match(self.store_globs, filename)
+
+    def cache_tag(self) -> str | None:
+        # The default settings keep their existing cache keys.
+        if self.level == DEFAULT_COMPRESS_LEVEL and not self.store_globs:
+            return None
+        return f"level={self.level};store={','.join(sorted(self.store_globs))}"
+
+
+@dataclass
+class CompressionStats:
+    members: int = 0
+    raw_bytes: int = 0
+    compressed_bytes: int = 0
+    seconds: float = 0.0
+
+    def add(self, member: MemberCompressor) -> None:
+        self.members += 1
+        self.raw_bytes += member.info.file_size
+        self.compressed_bytes += member.info.compress_size
+        self.seconds += member.seconds
+
+    def describe(self) -> str:
+        ratio = self.compressed_bytes / self.raw_bytes if self.raw_bytes else 1.0
+        return (
+            f"compressed {self.members} member(s), {self.raw_bytes / 1e6:.1f} MB -> "
+            f"{self.compressed_bytes / 1e6:.1f} MB ({ratio:.0%}) in {self.seconds:.2f}s"
+        )
+
+
+class MemberCompressor:
+    # Compresses one member as it is written into a spool, then appends it to a zip with its
+    # sizes and CRC already in the local header. zlib releases the GIL while it compresses, so
+    # several of these can run on threads at once.
+
+    def __init__(self, info: zipfile.ZipInfo, *, level: int = DEFAULT_COMPRESS_LEVEL, store: bool = False):
+        self.info = info
+        info.compress_type = zipfile.ZIP_STORED if store else zipfile.ZIP_DEFLATED
+        info.CRC = 0
+        info.file_size = 0
+        self._compressor = None if store else zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE)
+        self.seconds = 0.0
+
+    def write(self, data: bytes) -> None:
+        start = time.perf_counter()
+        self.info.CRC = zlib.crc32(data, self.info.CRC)
+        self.info.file_size += len(data)
+        self._spool.write(self._compressor.compress(data) if self._compressor else data)
+        self.seconds += time.perf_counter() - start
+
+    def finish(self) -> MemberCompressor:
+        if self._compressor:
+            start = time.perf_counter()
+            self._spool.write(self._compressor.flush())
+            self.seconds += time.perf_counter() - start
+        self.info.compress_size = self._spool.tell()
+        self._spool.seek(0)
+        return self
+
+    def append_to(self, dst: zipfile.ZipFile) -> None:
+        self.info.header_offset = dst.fp.tell()
+        dst.fp.write(self.info.FileHeader())
+        shutil.copyfileobj(self._spool, dst.fp, _COPY_BUFSIZE)
+        self.close()
+        _register_member(dst, self.info)
+
+    def close(self) -> None:
+        self._spool.close()
+
+
+class OrderedWriter:
+    # Runs member compression on a thread pool while appending the results to the output(s) in
+    # their original order, on the calling thread. `submit`ted functions run on the pool and
+    # return a callable that does the appending; `then` queues a callable to run in order with
+    # those. At most `2 * workers` results are held at once.
+
+    def __init__(self, workers: int | None = None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._queue: collections.deque = collections.deque()
+
+    def submit(self, fn: Callable[..., Callable[[], None]], *args) -> None:
+        self._queue.append(self._pool.submit(fn, *args))
+        self._drain(limit=2 * self.workers)
+
+    def then(self, fn: Callable[[], None]) -> None:
+        self._queue.append(fn)
+        self._drain(limit=2 * self.workers)
+
+    def _drain(self, limit: int) -> None:
+        # Appends whatever is ready at the head of the queue, blocking only while more than
+        # `limit` entries are outstanding.
+        while self._queue:
+            head = self._queue[0]
+            if isinstance(head, Future):
+                if len(self._queue) <= limit and not head.done():
+                    return
+                head.result()()
+            else:
+                head()
+            self._queue.popleft()
+
+    def __enter__(self) -> OrderedWriter:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self._drain(limit=0)
+        finally:
+            # Cancelled by hand, as `shutdown(cancel_futures=True)` needs Python 3.9.
+            for entry in self._queue:
+                if isinstance(entry, Future):
+                    entry.cancel()
+            self._queue.clear()
+            self._pool.shutdown(wait=True)
+
+
+def add_compression_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        default=DEFAULT_COMPRESS_LEVEL,
+        choices=range(0, 10),
+        metavar="0-9",
+        help="zlib level for the wheel members reversioning writes.",
+    )
+    parser.add_argument(
+        "--store",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Store members matching this glob uncompressed, e.g. already-compressed payloads ('*' for all).",
+    )
+    parser.add_argument("--compress-workers", type=int, default=None, help="Threads compressing members per wheel.")
+
+def compression_from_args(args: argparse.Namespace) -> Compression:
+    return Compression(level=args.compress_level, store_globs=tuple(args.store), workers=args.compress_workers)
+
+
+def stream_reversion(
+    *,
+    whl_file: str,
+    dest_dir: str,
+    target_version: str,
+    extra_globs: list[str] | None = None,
+    compression: Compression | None = None,
+) -> str:
+    return stream_reversions(
+        whl_file=whl_file,
+        dest_dir=dest_dir,
+        target_versions=[target_version],
+        extra_globs=extra_globs,
+        compression=compression,
+    )[target_version]
+
+def stream_reversions(
+    *,
+    whl_file: str,
+    dest_dir: str,
+    target_versions: list[str],
+    extra_globs: list[str] | None = None,
+    compression: Compression | None = None,
+) -> dict[str, str]:
+    # Reversions one input wheel to every target version in a single read of it, e.g. for dev
+    # and rc tags cut from the same commit. Returns the output path for each target version.
+    target_versions = list(dict.fromkeys(target_versions))
+    compression = compression or Compression()
+    all_globs = ["*.dist-info/*", "*-nspkg.pth", *(extra_globs or ())]
+    with open_zip(whl_file, "r") as src:
+        infos = [info for info in src.infolist() if not info.is_dir()]
+        dist_info_dir = locate_dist_info_member_dir(info.filename for info in infos)
+        record_name = f"{dist_info_dir}/RECORD"
+        input_version = read_member_version(src, f"{dist_info_dir}/METADATA")
+        from_bytes = input_version.encode("ascii")
+
+        # Find the members that mention the input version, streaming each so a huge member
+        # matched by `extra_globs` is never held in memory. Everything else is copied through as
+        # raw compressed bytes below.
+        version_bearing: set[str] = set()
+        for info in infos:
+            if not any_match(all_globs, info.filename):
+                continue
+            if input_version in info.filename:
+                version_bearing.add(info.filename)
+                continue
+            with src.open(info) as f:
+                if stream_contains(f.read, from_bytes):
+                    version_bearing.add(info.filename)
+        if record_name not in version_bearing:
+            raise Exception(
+                "Malformed whl or bad globs: `{}` was not rewritten.".format(record_name)
+            )
+
+        to_bytes = {target_version: target_version.encode("ascii") for target_version in target_versions}
+        fingerprints: dict[str, dict[str, tuple[str, str]]] = {target_version: {} for target_version in target_versions}
+        stats = {target_version: CompressionStats() for target_version in target_versions}
+        # Pool threads read through their own handles; `copy_raw_member_to_many` seeks `src.fp`.
+        handles: list[zipfile.ZipFile] = []
+        local = _ThreadLocalZips(whl_file, handles)
+
+        def rewrite_member(info: zipfile.ZipInfo) -> dict[str, tuple[MemberCompressor, tuple[str, str]]]:
+            # Rewrites one member for every target, decompressing the source once for all of them.
+            members = {
+                target_version: MemberCompressor(
+                    _rewritten_info(info, info.filename.replace(input_version, target_version)),
+                    level=compression.level,
+                    store=compression.stores(info.filename),
+                )
+                for target_version in target_versions
+            }
+            with local.zf.open(info.filename) as f:
+                results = stream_replace_to_many(
+                    f.read,
+                    [(to_bytes[target_version], member.write) for target_version, member in members.items()],
+                    from_bytes,
+                )
+            return {
+                target_version: (member.finish(), fingerprint)
+                for (target_version, member), fingerprint in zip(members.items(), results)
+            }
+
+        def record_rewrite(rewritten) -> None:
+            for target_version, (member, fingerprint) in rewritten.items():
+                fingerprints[target_version][member.info.filename] = fingerprint
+
+        def rewrite_and_append(info: zipfile.ZipInfo) -> Callable[[], None]:
+            rewritten = rewrite_member(info)
+
+            def append() -> None:
+                for target_version, (member, fingerprint) in rewritten.items():
+                    member.append_to(dsts[target_version])
+                    stats[target_version].add(member)
+                record_rewrite(rewritten)
+            return append
+
+        def append_record(n: int, info: zipfile.ZipInfo) -> None:
+            # RECORD needs the fingerprints of every rewritten member. They normally all come
+            # before it, so are written by now; hash any that don't (and write them later).
+            for later in infos[n + 1:]:
+                if later.filename in version_bearing:
+                    rewritten = rewrite_member(later)
+                    for member, _ in rewritten.values():
+                        member.close()
+                    record_rewrite(rewritten)
+            # RECORD grows with the member count, not member sizes, so it's rewritten in memory.
+            record = src.read(info)
+            for target_version, dst in dsts.items():
+                member = MemberCompressor(
+                    _rewritten_info(info, info.filename.replace(input_version, target_version)),
+                    level=compression.level,
+                    store=compression.stores(info.filename),
+                )
+                member.write(rewrite_record(record.replace(from_bytes, to_bytes[target_version]), fingerprints[target_version]))
+                member.finish().append_to(dst)
+                stats[target_version].add(member)
+
+        dst_whl_filenames = {
+            target_version: os.path.basename(whl_file).replace(input_version, target_version)
+            for target_version in target_versions
+        }
+        dst_whl_files = {}
+        with tempfile.TemporaryDirectory(dir=dest_dir) as chroot, ExitStack() as stack:
+            stack.callback(lambda: [handle.close() for handle in handles])
+            dsts = {
+                target_version: stack.enter_context(
+                    open_zip(os.path.join(chroot, filename), "w", zipfile.ZIP_DEFLATED)
+                )
+                for target_version, filename in dst_whl_filenames.items()
+            }
+            with OrderedWriter(compression.workers) as writer:
+                for n, info in enumerate(infos):
+                    if info.filename not in version_bearing:
+                        writer.then(functools.partial(copy_raw_member_to_many, src, list(dsts.values()), info))
+                    elif info.filename != record_name:
+                        writer.submit(rewrite_and_append, info)
+                    else:
+                        writer.then(functools.partial(append_record, n, info))
+            stack.close()
+            for target_version, filename in dst_whl_filenames.items():
+                tmp_whl_file = os.path.join(chroot, filename)
+                check_wheel(tmp_whl_file)
+                dst_whl_files[target_version] = os.path.join(dest_dir, filename)
+                shutil.move(tmp_whl_file, dst_whl_files[target_version])
+                print(f"{filename}: {stats[target_version].describe()}")
+    for target_version, dst_whl_file in dst_whl_files.items():
+        print("Wrote whl with version {} to {}.\n".format(target_version, dst_whl_file))
+    return dst_whl_files
+
+@dataclass(frozen=True)
+class WheelProblem:
+    member: str
+    kind: str
+    detail: str = ""
+
+    def describe(self) -> str:
+        return f"{self.member}: {self.kind}" + (f" ({self.detail})" if self.detail else "")
+
+
+@dataclass
+class ValidationReport:
+    wheel: str
+    members_checked: int = 0
+    problems: list[WheelProblem] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    def describe(self) -> str:
+        if self.ok:
+            return f"{self.wheel}: OK ({self.members_checked} members)"
+        return "\n".join(
+            [f"{self.wheel}: {len(self.problems)} problem(s)"]
+            + [f"  {problem.describe()}" for problem in self.problems]
+        )
+
+
+class InvalidWheel(Exception):
+    def __init__(self, report: ValidationReport):
+        self.report = report
+        super().__init__(report.describe())
+
+
+# Members that may legitimately appear in RECORD without a hash.
+_UNHASHED_SUFFIXES = ("/RECORD", "/RECORD.jws", "/RECORD.p7s")
+
+class _ThreadLocalZips(threading.local):
+    # Each worker thread reads through its own `ZipFile` handle so seeks don't interleave.
+
+    def __init__(self, whl_file: str, handles: list[zipfile.ZipFile]):
+        self.zf = zipfile.ZipFile(whl_file)
+        handles.append(self.zf)
+
+def _check_member(local: _ThreadLocalZips, name: str, expected_hash: str, expected_size: str) -> WheelProblem | None:
+    algorithm, _, expected_digest = expected_hash.partition("=")
+    try:
+        hasher = hashlib.new(algorithm)
+    except ValueError:
+        return WheelProblem(name, "unsupported-hash", algorithm)
+    size = 0
+    try:
+        with local.zf.open(name) as f:
+            while chunk := f.read(_COPY_BUFSIZE):
+                hasher.update(chunk)
+                size += len(chunk)
+    except (zipfile.BadZipfile, OSError, EOFError) as e:
+        # N.B.: zipfile checks each member's CRC as it reads, so corrupt data lands here.
+        return WheelProblem(name, "unreadable", str(e))
+    digest = base64.urlsafe_b64encode(hasher.digest()).rstrip(b"=").decode()
+    if digest != expected_digest:
+        return WheelProblem(name, "hash-mismatch", f"RECORD has {expected_hash}, got {algorithm}={digest}")
+    if expected_size and str(size) != expected_size:
+        return WheelProblem(name, "size-mismatch", f"RECORD has {expected_size}, got {size}")
+    return None
+
+_VALIDATE_BATCH = 256
+
+def validate_wheel(whl_file: str, *, max_workers: int | None = None) -> ValidationReport:
+    # Checks every member against its RECORD hash and size straight from the zip, which is what
+    # `wheel unpack` verifies, without the subprocess or the extraction.
+    report = ValidationReport(wheel=whl_file)
+    try:
+        with open_zip(whl_file, "r") as whl:
+            names = [info.filename for info in whl.infolist() if not info.is_dir()]
+            try:
+                record_name = f"{locate_dist_info_member_dir(names)}/RECORD"
+                record = whl.read(record_name).decode("utf-8")
+            except Exception as e:
+                report.problems.append(WheelProblem(whl_file, "missing-record", str(e)))
+                return report
+    # N.B.: Reported rather than raised, so one bad file doesn't abort a batch.
+    except zipfile.BadZipfile as e:
+        report.problems.append(WheelProblem(whl_file, "bad-zip", str(e)))
+        return report
+    except OSError as e:
+        report.problems.append(WheelProblem(whl_file, "unreadable", str(e)))
+        return report
+
+    to_check = []
+    recorded = set()
+    present = set(names)
+    for row in csv.reader(io.StringIO(record)):
+        if not row:
+            continue
+        if len(row) != 3:
+            report.problems.append(WheelProblem(record_name, "bad-record-line", ",".join(row)))
+            continue
+        name, expected_hash, expected_size = row
+        recorded.add(name)
+        if name not in present:
+            report.problems.append(WheelProblem(name, "missing-from-wheel"))
+        elif expected_hash:
+            to_check.append((name, expected_hash, expected_size))
+        elif not name.endswith(_UNHASHED_SUFFIXES):
+            report.problems.append(WheelProblem(name, "missing-hash"))
+    for name in names:
+        if name not in recorded:
+            report.problems.append(WheelProblem(name, "missing-from-record"))
+
+    handles: list[zipfile.ZipFile] = []
+    local = _ThreadLocalZips(whl_file, handles)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # In batches: a future per member costs more than hashing a small member does.
+            batches = [to_check[i : i + _VALIDATE_BATCH] for i in range(0, len(to_check), _VALIDATE_BATCH)]
+            results = [
+                problem
+                for batch in pool.map(lambda batch: [_check_member(local, *args) for args in batch], batches)
+                for problem in batch
+            ]
+    finally:
+        for handle in handles:
+            handle.close()
+    report.members_checked = len(to_check)
+    report.problems.extend(problem for problem in results if problem is not None)
+    return report
+
+def check_wheel(whl_file: str, *, max_workers: int | None = None) -> ValidationReport:
+    with tracey.span("validate", cat="cpu", wheel=os.path.basename(whl_file)):
+        report = validate_wheel(whl_file, max_workers=max_workers)
+    if not report.ok:
+        raise InvalidWheel(report)
+    return report
+
+
+class ReversionCache:
+    # `reversion` is a pure function of the input bytes, the target version and the globs, so its
+    # output can be replayed from a `BlobCache`. Each entry is the produced wheel plus a small JSON
+    # manifest holding its filename and RECORD.
+
+    def __init__(self, blobs: BlobCache):
+        self.blobs = blobs
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(input_sha256: str, target_version: str, globs: list[str], compression: Compression | None = None) -> str:
+        tag = compression.cache_tag() if compression else None
+        return cache_key("reversion", input_sha256, target_version, *sorted(set(globs)), *([tag] if tag else []))
+
+    def fetch(self, key: str, dest_dir: str) -> str | None:
+        manifest = self.blobs.get_bytes(f"{key}.json")
+        if manifest is not None:
+            dst_whl_file = os.path.join(dest_dir, json.loads(manifest)["filename"])
+            if self.blobs.get(key, dst_whl_file):
+                self.hits += 1
+                return dst_whl_file
+        self.misses += 1
+        return None
+
+    def store(self, key: str, dst_whl_file: str) -> None:
+        with open_zip(dst_whl_file, "r") as whl:
+            record_name = f"{locate_dist_info_member_dir(whl.namelist())}/RECORD"
+            record = whl.read(record_name).decode("utf-8")
+        self.blobs.put(key, dst_whl_file)
+        self.blobs.put_bytes(
+            f"{key}.json",
+            json.dumps({"filename": os.path.basename(dst_whl_file), "record": record}).encode("utf-8"),
+        )
+
+    def record(self, key: str) -> str | None:
+        manifest = self.blobs.get_bytes(f"{key}.json")
+        return None if manifest is None else json.loads(manifest)["record"]
+
+    def purge(self) -> None:
+        self.blobs.purge()
+
+
+def reversion(
+    *,
+    whl_file: str,
+    dest_dir: str,
+    target_version: str,
+    extra_globs: list[str] | None = None,
+    stream: bool = True,
+    cache: ReversionCache | None = None,
+    compression: Compression | None = None,
+) -> str:
+    key = None
+    if cache is not None:
+        key = cache.key(
+            sha256_file(whl_file),
+            target_version,
+            ["*.dist-info/*", "*-nspkg.pth", *(extra_globs or ())],
+            compression,
+        )
+        dst_whl_file = cache.fetch(key, dest_dir)
+        if dst_whl_file is not None:
+            print("Reused cached whl with version {} at {}.\n".format(target_version, dst_whl_file))
+            return dst_whl_file
+
+    # Streaming reads the source central directory once and passes untouched members through
+    # compressed; the extracting mode unpacks to disk and recompresses everything.
+    impl = stream_reversion if stream else extract_reversion
+    with tracey.span("rewrite", cat="cpu", wheel=os.path.basename(whl_file), stream=stream):
+        dst_whl_file = impl(
+            whl_file=whl_file,
+            dest_dir=dest_dir,
+            target_version=target_version,
+            extra_globs=extra_globs,
+            compression=compression,
+        )
+    if key is not None:
+        cache.store(key, dst_whl_file)
+    return dst_whl_file
+
+def reversion_many(
+    *,
+    whl_file: str,
+    dest_dir: str,
+    target_versions: list[str],
+    extra_globs: list[str] | None = None,
+    cache: ReversionCache | None = None,
+    compression: Compression | None = None,
+) -> dict[str, str]:
+    # Like `reversion`, for several target versions of the same input wheel. Cache misses are all
+    # produced by one `stream_reversions` pass over the input.
+    target_versions = list(dict.fromkeys(target_versions))
+    dst_whl_files: dict[str, str] = {}
+    keys: dict[str, str] = {}
+    if cache is not None:
+        input_sha256 = sha256_file(whl_file)
+        for target_version in target_versions:
+            key = cache.key(
+                input_sha256, target_version, ["*.dist-info/*", "*-nspkg.pth", *(extra_globs or ())], compression
+            )
+            dst_whl_file = cache.fetch(key, dest_dir)
+            if dst_whl_file is not None:
+                print("Reused cached whl with version {} at {}.\n".format(target_version, dst_whl_file))
+                dst_whl_files[target_version] = dst_whl_file
+            else:
+                keys[target_version] = key
+
+    missing = [target_version for target_version in target_versions if target_version not in dst_whl_files]
+    if missing:
+        with tracey.span("rewrite", cat="cpu", wheel=os.path.basename(whl_file), targets=len(missing)):
+            written = stream_reversions(
+                whl_file=whl_file,
+                dest_dir=dest_dir,
+                target_versions=missing,
+                extra_globs=extra_globs,
+                compression=compression,
+            )
+        for target_version, dst_whl_file in written.items():
+            if target_version in keys:
+                cache.store(keys[target_version], dst_whl_file)
+        dst_whl_files.update(written)
+    return {target_version: dst_whl_files[target_version] for target_version in target_versions}
+
+
+if __name__ == "__main__":
+    import sys
+
+    parser = argparse.ArgumentParser()
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    validate = subcommands.add_parser("validate", help="Check wheels against their RECORD.")
+    validate.add_argument("wheels", nargs="+")
+    validate.add_argument("--workers", type=int, default=None)
+    reversion_cmd = subcommands.add_parser(
+        "reversion", help="Reversion a wheel to one or more target versions in a single pass."
+    )
+    reversion_cmd.add_argument("wheel")
+    reversion_cmd.add_argument("target_versions", nargs="+")
+    reversion_cmd.add_argument("--dest-dir", default=".")
+    reversion_cmd.add_argument("--extra-glob", action="append", default=[])
+    add_compression_args(reversion_cmd)
+    args = parser.parse_args()
+
+    if args.command == "reversion":
+        reversion_many(
+            whl_file=args.wheel,
+            dest_dir=args.dest_dir,
+            target_versions=args.target_versions,
+            extra_globs=args.extra_glob,
+            compression=compression_from_args(args),
+        )
+        sys.exit(0)
+
+    failed = False
+    for whl_file in args.wheels:
+        report = validate_wheel(whl_file, max_workers=args.workers)
+        print(report.describe())
+        failed |= not report.ok
+    sys.exit(1 if failed else 0)